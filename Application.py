@@ -4,6 +4,7 @@ from tkinter import ttk
 
 from DataWindow import DataWindow
 from FileWindow import FileWindow
+from LivePlot import colors_map
 import _pickle as pickle
 
 class Application(ttk.PanedWindow):
@@ -20,16 +21,7 @@ class Application(ttk.PanedWindow):
                     pass
         self.out_dir = output_directory
 
-        self.colors_map = {
-            'Flow rate L upstream': '#ff7f0e',
-            'Flow rate L downstream': '#2ca02c',
-            'Temperature L upstream': '#d62728',
-            'Temperature L downstream': '#9467bd',
-            'Pressure L upstream': '#8c564b',
-            'Pressure L downstream': '#e377c2',
-            'CO2stream': '#7f7f7f',
-            'Mask pressure': '#bcbd22'
-        }
+        self.colors_map = dict(colors_map)
 
         self.root = master
         self.grid(row=0, column=0, sticky=tk.NSEW)
@@ -57,11 +49,44 @@ class Application(ttk.PanedWindow):
                 plot_params = p['plot_params']
         return plot_params
 
+    def get_blit(self):
+        blit = False
+        with open('config.json', 'r') as f:
+            p = json.load(f)
+            if 'blit' in p:
+                blit = p['blit']
+        return blit
+
+    def get_reader_params(self):
+        reader_params = {}
+        with open('config.json', 'r') as f:
+            p = json.load(f)
+            if 'reader_params' in p:
+                reader_params = p['reader_params']
+        return reader_params
+
+    def get_score_interval(self):
+        score_interval = 10
+        with open('config.json', 'r') as f:
+            p = json.load(f)
+            if 'score_interval' in p:
+                score_interval = p['score_interval']
+        return score_interval
+
+    def get_max_log_lines(self):
+        max_log_lines = 5000
+        with open('config.json', 'r') as f:
+            p = json.load(f)
+            if 'max_log_lines' in p:
+                max_log_lines = p['max_log_lines']
+        return max_log_lines
+
     def get_targets(self):
         return self.left_panes.targets
 
     def close(self):
         self.left_panes.close()
+        self.right_panes.close()
         self.root.quit()
         self.root.destroy()
 
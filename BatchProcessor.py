@@ -0,0 +1,267 @@
+import csv
+import json
+import multiprocessing
+import os
+import time
+
+import h5py
+import pandas as pd
+from matplotlib import pyplot as plt
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+from LiveH5Reader import LiveH5Reader
+from LivePlot import LivePlot
+from LogIndex import LogIndex
+from LogParser import LogParser
+from Manifest import Manifest
+from MetadataExtractor import MetadataExtractor, plain_value
+from preprocessing import ReCIVA_log_preprocessor
+from SessionData import SessionData
+from StreamingPdfMerger import StreamingPdfMerger
+
+
+class BatchProcessor(object):
+    # Scoring and report generation for finished sessions, shared by the Files pane and the command line. Nothing in
+    # here touches Tk, so it runs on a machine without a display.
+    def __init__(self, out_dir, colors_map, model=None, n_workers=None, log=None):
+        self.out_dir = out_dir
+        self.colors_map = colors_map
+        self.model = model
+        self.n_workers = n_workers
+        if n_workers is None:
+            self.n_workers = multiprocessing.cpu_count()
+        self.log = log
+        self.log_parser = LogParser()
+        self.pool = None
+
+    def get_pool(self):
+        # Kept for the lifetime of the processor: each worker imports the rendering stack and builds its figures once
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.n_workers, initializer=init_plot_worker)
+        return self.pool
+
+    def report_progress(self, n_done, n_total, tic):
+        if self.log is not None:
+            rate = n_done / max(time.perf_counter() - tic, 1e-9)
+            self.log(f'Processed {n_done}/{n_total} files ({rate:.2f} files/s)')
+
+    def plot_files(self, paths, targets, plot_params=None):
+        if self.log is not None:
+            self.log(f'Processing selected files and saving to {self.out_dir}...')
+
+        # A session keeps its PDF and metadata from an earlier run if neither it nor the plot layout changed
+        manifest = Manifest(self.out_dir)
+        layout = json.dumps({'targets': targets, 'plot_params': plot_params}, sort_keys=True)
+        results = [None] * len(paths)
+        args_list = []
+        for i, path in enumerate(paths):
+            metadata = manifest.get(path, 'metadata')
+            if metadata is not None and manifest.get(path, 'layout') == layout and \
+                    os.path.isfile(os.path.join(self.out_dir, metadata['File'] + '.pdf')):
+                results[i] = metadata
+            else:
+                args_list.append((i, (path, targets, plot_params, self.colors_map, self.log_parser, self.out_dir)))
+        if self.log is not None and len(args_list) < len(paths):
+            self.log(f'Reusing {len(paths) - len(args_list)} unchanged files from {manifest.path}')
+
+        # summary.csv gets a row per file as results come in, in completion order, and summary.pdf the pages in input
+        # order, each file once every earlier one is done. Both are complete files after every step, so whatever
+        # finished survives an interrupted batch. summary.xlsx takes its rows in input order too, into a write-only
+        # sheet that openpyxl spools to disk, but a workbook can only be saved whole, at the end.
+        os.makedirs(self.out_dir, exist_ok=True)
+        next_page = 0
+        n_summary_rows = 0
+        merger = StreamingPdfMerger(os.path.join(self.out_dir, 'summary.pdf'))
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Sheet1')
+        fieldnames = ['File'] + MetadataExtractor.columns
+        sheet.append([self.header_cell(sheet, name) for name in fieldnames])
+        with open(os.path.join(self.out_dir, 'summary.csv'), 'w', newline='') as summary_csv:
+            writer = csv.DictWriter(summary_csv, fieldnames=fieldnames)
+            writer.writeheader()
+            for result in results:
+                if result is not None:
+                    writer.writerow(result)
+
+            rendered = iter([])
+            if len(args_list) > 0:
+                rendered = self.get_pool().imap_unordered(plot_indexed_file, args_list)
+            n_done = 0
+            tic = time.perf_counter()
+            while True:
+                while next_page < len(results) and results[next_page] is not None:
+                    if type(results[next_page]) != str:
+                        file = os.path.join(self.out_dir, results[next_page]['File'] + '.pdf')
+                        if os.path.isfile(file):
+                            merger.add_pdf(file)
+                        sheet.append([plain_value(results[next_page].get(name)) for name in fieldnames])
+                        n_summary_rows += 1
+                    next_page += 1
+
+                i, result = next(rendered, (None, None))
+                if i is None:
+                    break
+                results[i] = result
+                if type(result) == str:
+                    if self.log is not None:
+                        self.log(result)
+                else:
+                    writer.writerow(result)
+                    summary_csv.flush()
+                    manifest.update(paths[i], metadata=result, layout=layout)
+                    manifest.save()
+                n_done += 1
+                self.report_progress(n_done, len(args_list), tic)
+        merger.close()
+
+        if n_summary_rows > 0:
+            workbook.save(os.path.join(self.out_dir, 'summary.xlsx'))
+
+            if self.log is not None:
+                self.log(f'Finished processing files')
+                self.log(f'Success Saved summary.xlsx and summary.pdf to {self.out_dir}...')
+        return results
+
+    def header_cell(self, sheet, name):
+        # Bold, like the header pandas used to write
+        cell = WriteOnlyCell(sheet, value=name)
+        cell.font = Font(bold=True)
+        return cell
+
+    def score_files(self, paths, progress=None, cancel=None):
+        # progress(i, features) is called as each file's features come in; setting the cancel event stops the batch,
+        # keeping the features extracted so far in the manifest, and returns None
+        manifest = Manifest(self.out_dir)
+        feature_rows = [manifest.get(path, 'features') for path in paths]
+        args_list = [(i, path) for i, path in enumerate(paths) if feature_rows[i] is None]
+        if self.log is not None and len(args_list) < len(paths):
+            self.log(f'Reusing features of {len(paths) - len(args_list)} unchanged files from {manifest.path}')
+        if progress is not None:
+            for i, features in enumerate(feature_rows):
+                if features is not None:
+                    progress(i, features)
+
+        tic = time.perf_counter()
+        if len(args_list) > 0:
+            results = self.get_pool().imap_unordered(extract_indexed_file_features, args_list)
+            n_done = 0
+            while n_done < len(args_list):
+                if cancel is not None and cancel.is_set():
+                    manifest.save()
+                    # The workers are still busy with the rest of the batch
+                    self.close()
+                    return None
+                try:
+                    i, features = results.next(timeout=0.1)
+                except multiprocessing.TimeoutError:
+                    continue
+                feature_rows[i] = features
+                if features is not None:
+                    manifest.update(paths[i], features=features)
+                n_done += 1
+                self.report_progress(n_done, len(args_list), tic)
+                if progress is not None:
+                    progress(i, features)
+
+        scores = self.compute_scores(feature_rows)
+        for path, features, score in zip(paths, feature_rows, scores):
+            if features is not None:
+                manifest.update(path, score=score)
+        manifest.save()
+        return scores
+
+    def compute_scores(self, feature_rows):
+        scores = [1] * len(feature_rows)
+        # One predict_proba call per feature layout: a session without CO2 cycle periods lacks those columns, and
+        # must still fail on its own rather than be scored with NaN in a shared frame
+        groups = {}
+        for i, features in enumerate(feature_rows):
+            if features is not None:
+                groups.setdefault(tuple(features), []).append(i)
+        for indices in groups.values():
+            try:
+                feature_df = pd.DataFrame([feature_rows[i] for i in indices])
+                for i, score in zip(indices, self.model.predict_proba(feature_df)[:, 1]):
+                    scores[i] = score
+            except:
+                pass
+        return scores
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+def extract_file_features(path):
+    features = None
+    try:
+        with h5py.File(path, 'r', libver='latest', locking=False) as file:
+            df = SessionData(file).to_frame()
+        if df.shape[0] > 0:
+            features = ReCIVA_log_preprocessor().extract_features(df, extra=True)
+            # As floats, which the manifest reloads unchanged, so a cached session scores exactly like a fresh one
+            features = {name: float(value) for name, value in features.items()}
+    except:
+        pass
+    return features
+
+
+def extract_indexed_file_features(args):
+    i, path = args
+    return i, extract_file_features(path)
+
+
+plot_templates = {}
+
+
+def init_plot_worker():
+    # Pay for the backend and font set-up once per worker rather than on the first file it plots
+    plt.switch_backend('agg')
+    fig = plt.figure()
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def plot_template(targets, plot_params, colors_map):
+    # One LivePlot per worker and plot layout, reset between files instead of rebuilding the figure and its axes
+    key = (tuple(targets), json.dumps(plot_params, sort_keys=True))
+    if key not in plot_templates:
+        if plot_params is not None:
+            plot_params = dict(plot_params)
+        plot_templates[key] = LivePlot('Collection time', False, targets, 'Accumulated volume L', 1,
+                                       colors_map=colors_map, plot_params=plot_params, backend='agg')
+    liveplot = plot_templates[key]
+    liveplot.reset()
+    return liveplot
+
+
+def plot_indexed_file(args):
+    i, args = args
+    return i, plot_file(*args)
+
+
+def plot_file(path, targets, plot_params, colors_map, log_parser, out_dir):
+    filename, _ = os.path.splitext(os.path.basename(path))
+    try:
+        with h5py.File(path, 'r', libver='latest', locking=False) as file:
+            session = SessionData(file)
+            log_index = LogIndex(log_parser)
+            reader = LiveH5Reader(file, targets + ['Accumulated volume L', 'Pump L current'], timeout=0,
+                                  log_index=log_index)
+
+            liveplot = plot_template(targets, plot_params, colors_map)
+            liveplot.initial_data(reader.read_session(session))
+
+            reader.read_all_logs()
+            liveplot.set_errors(*log_index.get_warnings_and_errors())
+            liveplot.increment_timer()
+
+            os.makedirs(out_dir, exist_ok=True)
+            metadata = liveplot.save(os.path.join(out_dir, filename + '.pdf'), file, session, log_index)
+            metadata['File'] = filename
+            return metadata
+    except Exception as e:
+        return f'Error Failed to process {filename} due to {repr(e)}'
@@ -4,9 +4,10 @@ from tkinter import ttk
 
 from lightgbm import LGBMClassifier
 
+from LogIndex import LogIndex
 from LogParser import LogParser
-from preprocessing import ReCIVA_log_preprocessor
-from LiveH5Reader import LiveH5Reader
+from preprocessing import ReCIVA_online_preprocessor
+from LiveH5Reader import LiveH5Reader, AcquisitionThread, PollScheduler
 from LivePlot import LivePlot
 from LiveTextView import LiveTextView
 import os
@@ -28,6 +29,7 @@ class DataWindow(tk.PanedWindow):
         self.master = master
         self.file = None
         self.reader = None
+        self.acquisition = None
         self.canvas = None
         self.toolbar = None
         self.liveplot = None
@@ -37,11 +39,15 @@ class DataWindow(tk.PanedWindow):
         self.canvas_frame = tk.Frame(self)
         self.bottom_frame = tk.Frame(self)
 
-        self.livetext = LiveTextView(self.bottom_frame)
+        self.livetext = LiveTextView(self.bottom_frame, max_lines=master.get_max_log_lines())
         self.initial_time = None
         self.final_score = None
+        self.provisional_score = None
+        self.provisional_thread = None
+        self.features = None
 
         self.log_parser = LogParser()
+        self.log_index = None
 
         self.src = src
         self.file_widget = FileWidget(self.top_frame, label='File', callback=self.open_file, font=32)
@@ -56,6 +62,7 @@ class DataWindow(tk.PanedWindow):
 
         self.log_lock = threading.Lock()
         self.log_flag = False
+        self.score_flag = False
 
         self.range_limit = False
 
@@ -68,8 +75,6 @@ class DataWindow(tk.PanedWindow):
         if model is None:
             self.livetext.add('Warning: no model found, check \'model_path\' in config.json')
 
-        self.preprocessor = ReCIVA_log_preprocessor()
-
         self.livetext.grid(row=0, column=1, columnspan=2, sticky=tk.NSEW)
 
         self.top_frame.grid_rowconfigure(0, weight=1, minsize=32)
@@ -122,6 +127,12 @@ class DataWindow(tk.PanedWindow):
         flow_down_switch.grid(row=1, column=0, columnspan=2, sticky=tk.NSEW)
         scope_switch.grid(row=2, column=0, columnspan=2, sticky=tk.NSEW)
 
+        self.score_label = tk.Label(basic_frame, text='Provisional score: -', font=32)
+        self.score_label.grid(row=3, column=0, columnspan=2, sticky=tk.NSEW)
+
+        self.status_label = tk.Label(basic_frame, text='', justify='left', anchor='w')
+        self.status_label.grid(row=4, column=0, columnspan=2, sticky=tk.NSEW)
+
         temperature_up_switch.grid(row=0, column=0, sticky=tk.NSEW)
         temperature_down_switch.grid(row=1, column=0, sticky=tk.NSEW)
         pressure_up_switch.grid(row=2, column=0, sticky=tk.NSEW)
@@ -146,9 +157,8 @@ class DataWindow(tk.PanedWindow):
 
 
 
-    def add_errors_from_logs(self, logs):
-        warnings, errors = self.log_parser.get_warnings_and_errors(logs)
-        self.liveplot.add_errors(warnings, errors)
+    def update_errors(self):
+        self.liveplot.set_errors(*self.log_index.get_warnings_and_errors())
 
     def reload_file(self):
         self.select_file_from_src()
@@ -166,15 +176,22 @@ class DataWindow(tk.PanedWindow):
             self.toolbar.pack(fill=tk.X, side=tk.TOP)
 
     def create_plot_from_file(self, file):
-        if self.reader is not None:
-            with self.log_lock:
-                self.reader.terminate()
-
-        self.reader = LiveH5Reader(file, self.targets + self.hidden_targets)
+        self.stop_acquisition()
+
+        reader_params = self.master.get_reader_params()
+        self.features = ReCIVA_online_preprocessor()
+        # The index parses on the acquisition thread with a parser of its own; the log view's parser stays on this thread
+        self.log_index = LogIndex()
+        # Every channel is read so that toggling a target later only changes what the plot shows
+        self.reader = LiveH5Reader(file, list(self.colors_map) + self.hidden_targets,
+                                   timeout=reader_params.get('completion_timeout', 10), features=self.features,
+                                   log_index=self.log_index)
         self.final_score = None
+        self.score_label.config(text='Provisional score: -')
+        self.status_label.config(text='')
 
         logs = self.reader.read_all_logs()
-        self.log_parser.set_initial_time(logs)
+        self.log_parser.initial_time = self.log_index.get_initial_time()
         self.livetext.clear()
         self.livetext.add_all_and_scroll_to_bottom(logs, self.log_parser)
         self.livetext.text.yview(tk.END)
@@ -182,19 +199,35 @@ class DataWindow(tk.PanedWindow):
         if self.liveplot is not None:
             self.liveplot.close()
 
-        self.liveplot = LivePlot('Collection time', self.range_limit, self.targets, 'Accumulated volume L', 1,
-                                 colors_map = self.colors_map, plot_params=self.master.get_plot_params())
-        self.liveplot.initial_data(self.reader.read_all_data())
-        self.liveplot.read(self.reader.read_data())
+        self.liveplot = LivePlot('Collection time', self.range_limit, list(self.colors_map), 'Accumulated volume L', 1,
+                                 colors_map = self.colors_map, plot_params=self.master.get_plot_params(),
+                                 blit=self.master.get_blit(), visible_labels=self.targets)
+        if reader_params.get('progressive_open', False):
+            # Show the latest rows straight away; the acquisition thread backfills the rest between live polls
+            self.liveplot.initial_data(self.reader.read_tail(reader_params.get('tail_rows', 3000)))
+        else:
+            self.liveplot.initial_data(self.reader.read_all_data())
+        path = None
+        if reader_params.get('wake_on_mtime', False):
+            path = file.filename
+        scheduler = PollScheduler(min_interval=reader_params.get('min_interval', self.liveplot.max_interval / 1000),
+                                  max_interval=reader_params.get('max_interval', 2), path=path)
+        self.acquisition = AcquisitionThread(self.reader, scheduler=scheduler,
+                                             history_chunk_rows=reader_params.get('history_chunk_rows', 20000))
+        self.acquisition.start()
+        self.liveplot.read(self.acquisition.read_data(), history=self.acquisition.read_history)
         with self.log_lock:
             self.reset_timer()
 
-        self.add_errors_from_logs(logs)
+        self.update_errors()
 
         with self.log_lock:
             if not self.log_flag:
                 self.log_flag = True
                 self.livetext.after(0, self.poll_logs)
+            if not self.score_flag:
+                self.score_flag = True
+                self.livetext.after(0, self.poll_provisional_score)
 
     def select_file_from_src(self):
         if os.path.isdir(self.src):
@@ -212,6 +245,7 @@ class DataWindow(tk.PanedWindow):
         file_path = self.file_widget.path()
         if file_path is not None and os.path.isfile(file_path):
             if self.file is not None:
+                self.stop_acquisition()
                 self.file.close()
             self.file = h5py.File(file_path, 'r', swmr=True, libver='latest', locking=False)
         self.draw_plot()
@@ -219,31 +253,54 @@ class DataWindow(tk.PanedWindow):
     def reset_timer(self):
         self.liveplot.reset_timer()
 
-    def poll_logs(self):
+    def stop_acquisition(self):
         with self.log_lock:
-            logs = self.reader.read_all_logs()
-            self.log_parser.set_initial_time(logs)
-            self.add_errors_from_logs(logs)
-            self.livetext.add_all_and_scroll_to_bottom(logs)
-
+            if self.reader is not None:
+                self.reader.terminate()
+            if self.acquisition is not None:
+                self.acquisition.terminate()
 
-        if self.reader.complete:
+    def poll_logs(self):
+        with self.log_lock:
+            finished = not self.acquisition.is_alive()
+            logs = self.acquisition.read_all_logs()
+            if len(logs) > 0:
+                # The reader has already folded these lines into the log index, and hands them on parsed
+                self.update_errors()
+                self.log_parser.initial_time = self.log_index.get_initial_time()
+            self.livetext.add_all_and_scroll_to_bottom(logs, self.log_parser)
+            self.show_metrics()
+
+        if finished and self.acquisition.error is not None:
+            self.abort_file()
+        elif finished:
             self.terminate_file()
         else:
             self.livetext.after(1000, self.poll_logs)
 
+    def show_metrics(self):
+        metrics = self.acquisition.metrics()
+        self.status_label.config(text=f"Rows read: {metrics['Rows read']} (history {metrics['History rows read']}), "
+                                      f"read time {metrics['Read time']:.2f} s, poll every {metrics['Poll interval']:.2f} s\n"
+                                      f"Queued batches: {metrics['Queued batches']} (max {metrics['Max queued batches']}), "
+                                      f"stalls: {metrics['Stalls']}, read errors: {metrics['Read errors']}")
+
+    def abort_file(self):
+        with self.log_lock:
+            self.liveplot.stop_timer()
+            self.log_flag = False
+            self.livetext.add_and_scroll_to_bottom(f'Error: Reading stopped due to {repr(self.acquisition.error)}')
+            self.file.close()
+
     def terminate_file(self):
         with self.log_lock:
             self.liveplot.stop_timer()
             self.log_flag = False
             if self.model is not None:
-                data = {}
-                for attr in self.file['Data'].dtype.names:
-                    data[attr] = self.file['Data'][attr]
-                df = pd.DataFrame(data)
-                if df.shape[0] > 0:
-                    t = threading.Thread(target=lambda: self.compute_score(df))
-                    t.start()
+                # Every row has already been folded into the online features, so the final score needs no re-read
+                if len(self.features) > 0:
+                    # Scored off the GUI thread, poll_score shows it once it is there
+                    threading.Thread(target=self.compute_final_score, args=(self.features,), daemon=True).start()
                     self.livetext.after(0, self.poll_score)
                 else:
                     self.livetext.text.config(state='normal')
@@ -253,16 +310,63 @@ class DataWindow(tk.PanedWindow):
 
             self.file.close()
 
-    def compute_score(self, df):
+    def compute_final_score(self, features):
+        score = self.compute_score(features)
+        with self.log_lock:
+            # Unless another file has been opened meanwhile
+            if features is self.features:
+                self.final_score = score
+
+    def compute_score(self, features=None):
+        if features is None:
+            features = self.features
         try:
-            features = self.preprocessor.extract_features(df, extra=True)
+            features = features.current_features(extra=True)
             feature_df = pd.DataFrame(features, index=[0])
-            self.final_score = self.model.predict_proba(feature_df)[0, 1]
+            return self.model.predict_proba(feature_df)[0, 1]
         except:
-            self.final_score = 1
+            return 1
+
+    def poll_provisional_score(self):
+        scoring = False
+        with self.log_lock:
+            running = self.acquisition is not None and self.acquisition.is_alive()
+            if running and self.model is not None and len(self.features) > 0:
+                # The snapshot and predict grow with the session, so they run on a worker and only the label is set here
+                scoring = True
+                self.provisional_score = None
+                self.provisional_thread = threading.Thread(target=self.compute_provisional_score,
+                                                           args=(self.features,), daemon=True)
+                self.provisional_thread.start()
+
+        if scoring:
+            self.livetext.after(100, self.show_provisional_score)
+        elif running:
+            self.livetext.after(int(self.master.get_score_interval() * 1000), self.poll_provisional_score)
+        else:
+            self.score_flag = False
+
+    def compute_provisional_score(self, features):
+        score = self.compute_score(features)
+        with self.log_lock:
+            # Unless another file has been opened meanwhile
+            if features is self.features:
+                self.provisional_score = score
+
+    def show_provisional_score(self):
+        if self.provisional_thread.is_alive():
+            self.livetext.after(100, self.show_provisional_score)
+            return
+        with self.log_lock:
+            score = self.provisional_score
+            if score is not None and self.final_score is None:
+                verdict = 'accept' if score <= self.model.threshold_90 else 'reject'
+                self.score_label.config(text=f'Provisional score: {score:.2f} ({verdict})')
+        self.livetext.after(int(self.master.get_score_interval() * 1000), self.poll_provisional_score)
 
     def poll_score(self):
         if self.final_score is not None:
+            self.score_label.config(text=f'Final score: {self.final_score:.2f}')
             self.livetext.text.config(state='normal')
             if self.final_score > self.model.threshold_90:
                 self.livetext.add('Warning: Model rejects sample at 90% significance level', self.log_parser)
@@ -279,7 +383,9 @@ class DataWindow(tk.PanedWindow):
             self.targets.append(y_target)
         elif y_target in self.targets:
             self.targets.remove(y_target)
-        if self.file is not None:
+        if self.liveplot is not None:
+            self.liveplot.set_visible_labels(self.targets)
+        elif self.file is not None:
             if self.file:
                 self.draw_plot()
             else:
@@ -287,19 +393,20 @@ class DataWindow(tk.PanedWindow):
 
     def toggle_range_limit(self, identity, activate):
         self.range_limit = activate
-        if self.file is not None:
+        if self.liveplot is not None:
+            self.liveplot.set_range_limit(activate)
+        elif self.file is not None:
             if self.file:
                 self.draw_plot()
             else:
                 self.open_file()
 
     def close(self):
+        self.stop_acquisition()
         if self.file is not None:
             self.file.close()
         with self.log_lock:
             self.log_flag = False
-            if self.reader is not None:
-                self.reader.terminate()
 
 
 class FileWidget(tk.Frame):
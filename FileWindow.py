@@ -1,19 +1,11 @@
-import os
-import multiprocessing
 import threading
 import tkinter as tk
+from collections import deque
 from tkinter import filedialog
 
-import h5py
-import pandas as pd
 from lightgbm import LGBMClassifier
-from tqdm import tqdm
 
-from LiveH5Reader import LiveH5Reader
-from LivePlot import LivePlot
-from LogParser import LogParser
-from preprocessing import ReCIVA_log_preprocessor
-from pdfrw import PdfWriter, PdfReader
+from BatchProcessor import BatchProcessor
 
 
 class FileWindow(tk.Frame):
@@ -31,9 +23,15 @@ class FileWindow(tk.Frame):
         self.log = logging_callback
 
         self.widget_lock = WidgetLock([self.select_files_btn, self.check_files_btn, self.clear_files_btn, self.plot_files_btn])
-        self.log_parser = LogParser()
 
         self.scores = []
+        self.checking = False
+        self.check_thread = None
+        self.check_cancel = None
+        self.check_results = deque()
+        self.check_scores = None
+        self.check_error = None
+        self.batch = BatchProcessor(self.out_dir, self.colors_map, model=self.model, log=self.log)
 
         self.grid_rowconfigure(0, weight=7)
         self.grid_rowconfigure(1, weight=1)
@@ -46,11 +44,13 @@ class FileWindow(tk.Frame):
         self.clear_files_btn = tk.Button(self.control_frame, text='Clear', command=self.clear_files)
         self.check_files_btn = tk.Button(self.control_frame, text='Check Files', command=self.check_files)
         self.plot_files_btn = tk.Button(self.control_frame, text='Plot', command=self.plot_files)
+        self.cancel_btn = tk.Button(self.control_frame, text='Cancel', command=self.cancel_check, state='disabled')
 
         self.select_files_btn.grid(row=0, column=0, columnspan=2, sticky=tk.NSEW)
         self.clear_files_btn.grid(row=1, column=0, columnspan=2, sticky=tk.NSEW)
         self.check_files_btn.grid(row=2, column=0, columnspan=2, sticky=tk.NSEW)
         self.plot_files_btn.grid(row=3, column=0, columnspan=2, sticky=tk.NSEW)
+        self.cancel_btn.grid(row=4, column=0, columnspan=2, sticky=tk.NSEW)
         self.control_frame.grid_rowconfigure((0, 1, 2, 3, 4), weight=1)
         self.control_frame.grid_columnconfigure((0, 1), weight=1)
 
@@ -73,37 +73,73 @@ class FileWindow(tk.Frame):
         self.scores = []
 
     def check_files(self):
-        with self.widget_lock:
+        if len(self.scores) >= self.file_listbox.size():
+            self.update_scores()
+            return
+
+        self.widget_lock.lock()
+        self.cancel_btn.config(state='normal')
+        files = list(self.file_listbox.get(len(self.scores), self.file_listbox.size()))
+        for i in range(len(self.scores), self.file_listbox.size()):
+            self.file_listbox.itemconfig(i, bg='light yellow')
+
+        # Scoring runs on a thread of its own, through the batch processor's worker pool. Each file's features land in
+        # check_results as they come in and are picked up by poll_check.
+        self.checking = True
+        self.check_results = deque()
+        self.check_scores = None
+        self.check_error = None
+        self.check_cancel = threading.Event()
+        self.check_thread = threading.Thread(target=self.run_check, args=(files, self.check_cancel), daemon=True)
+        self.check_thread.start()
+        self.after(0, self.poll_check)
+
+    def run_check(self, files, cancel):
+        try:
+            self.check_scores = self.batch.score_files(
+                files, progress=lambda i, features: self.check_results.append((i, features)), cancel=cancel)
+        except Exception as e:
+            self.check_error = e
+
+    def poll_check(self):
+        if not self.checking:
+            return
+        while len(self.check_results) > 0:
+            i, features = self.check_results.popleft()
+            self.file_listbox.itemconfig(len(self.scores) + i, bg='light grey' if features is not None else 'red')
+
+        if self.check_thread.is_alive():
+            self.after(100, self.poll_check)
+            return
+
+        self.checking = False
+        self.cancel_btn.config(state='disabled')
+        self.widget_lock.unlock()
+        if self.check_error is not None:
+            self.reset_unscored()
+            if self.log is not None:
+                self.log(f'Error: Failed to check files due to {repr(self.check_error)}')
+        elif self.check_scores is None:
+            # Cancelled
+            self.reset_unscored()
+        else:
+            self.scores += self.check_scores
             self.update_scores()
 
+    def cancel_check(self):
+        if self.checking and not self.check_cancel.is_set():
+            # The thread keeps the features extracted so far for the next run and stops. It is not joined here: it may be
+            # logging through Tk, which needs this thread's main loop, so poll_check unlocks the buttons once it is done.
+            self.check_cancel.set()
+            self.cancel_btn.config(state='disabled')
+            if self.log is not None:
+                self.log('Warning: Cancelled checking files')
 
-    def load_as_df(self, file):
-        file = h5py.File(file, 'r', libver='latest', locking=False)
-        data = {}
-        for attr in file['Data'].dtype.names:
-            data[attr] = file['Data'][attr]
-        return pd.DataFrame(data)
-
-    def compute_score(self, df):
-        score = 1
-        try:
-            preprocessor = ReCIVA_log_preprocessor()
-            features = preprocessor.extract_features(df, extra=True)
-            feature_df = pd.DataFrame(features, index=[0])
-            score = self.model.predict_proba(feature_df)[0, 1]
-        except:
-            pass
-        return score
+    def reset_unscored(self):
+        for i in range(len(self.scores), self.file_listbox.size()):
+            self.file_listbox.itemconfig(i, bg='')
 
     def update_scores(self):
-        if len(self.scores) < self.file_listbox.size():
-            files = list(self.file_listbox.get(len(self.scores), self.file_listbox.size()))
-            for i, file in enumerate(files):
-                score = 1
-                df = self.load_as_df(file)
-                if df is not None and df.shape[0] > 0:
-                    score = self.compute_score(df)
-                self.scores.append(score)
         for i, score in enumerate(self.scores):
             if score > self.model.threshold_90:
                 self.file_listbox.itemconfig(i, bg='red')
@@ -119,72 +155,27 @@ class FileWindow(tk.Frame):
             targets = self.master.get_targets()
 
             if self.file_listbox.size() > 0:
-                args_list = []
-                for path in self.file_listbox.get(0, self.file_listbox.size()):
-                    filename, _ = os.path.splitext(os.path.basename(path))
-                    args_list.append((path, targets, plot_params, self.colors_map, self.log_parser, self.out_dir))
-                if self.log is not None:
-                    self.log(f'Processing selected files and saving to {self.out_dir}...')
-                p = multiprocessing.Pool(16, maxtasksperchild=1)
-                results = p.starmap(plot_file, args_list)
-                results = [r for r in results if not type(r) == str]
-
-
-                summary_df = pd.DataFrame(results)
-                summary_df.set_index('File').to_excel(os.path.join(self.out_dir, 'summary.xlsx'))
-
-                p = multiprocessing.Pool(16)
-                files = summary_df['File'].copy()
-                files = [os.path.join(self.out_dir, file + '.pdf') for file in files]
-                merger = PdfWriter()
-
-                for file in files:
-                    if os.path.isfile(file):
-                        merger.addpages(PdfReader(file).pages)
-                merger.write(os.path.join(self.out_dir, 'summary.pdf'))
-
-                if self.log is not None:
-                    self.log(f'Finished processing files')
-                    self.log(f'Success Saved summary.xlsx and summary.pdf to {self.out_dir}...')
-
-
-def plot_file(path, targets, plot_params, colors_map, log_parser, out_dir):
-    filename, _ = os.path.splitext(os.path.basename(path))
-    try:
-        file = h5py.File(path, 'r', libver='latest', locking=False)
-        reader = LiveH5Reader(file, targets + ['Accumulated volume L', 'Pump L current'])
+                self.batch.plot_files(list(self.file_listbox.get(0, self.file_listbox.size())), targets, plot_params)
 
-        liveplot = LivePlot('Collection time', False, targets, 'Accumulated volume L', 1,
-                                     colors_map=colors_map, plot_params=plot_params)
-        liveplot.initial_data(reader.read_all_data())
+    def close(self):
+        self.cancel_check()
+        self.batch.close()
 
-        logs = reader.read_all_logs()
-        log_parser.set_initial_time(logs)
-        warnings, errors = log_parser.get_warnings_and_errors(logs)
-        liveplot.add_errors(warnings, errors)
-
-        liveplot.read(reader.read_data())
-        liveplot.increment_timer()
-
-
-
-
-        os.makedirs(out_dir, exist_ok=True)
-        metadata = liveplot.save(os.path.join(out_dir, filename + '.pdf'), file)
-        metadata['File'] = filename
-        liveplot.close()
-        return metadata
-    except Exception as e:
-        raise f'Error Failed to process {filename} due to {repr(e)}'
 
 class WidgetLock:
     def __init__(self, widgets):
         self.widgets = widgets
 
-    def __enter__(self):
+    def lock(self):
         for widget in self.widgets:
             widget.config(state='disabled')
 
-    def __exit__(self, type, value, traceback):
+    def unlock(self):
         for widget in self.widgets:
             widget.config(state='normal')
+
+    def __enter__(self):
+        self.lock()
+
+    def __exit__(self, type, value, traceback):
+        self.unlock()
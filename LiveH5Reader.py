@@ -1,5 +1,13 @@
 
 
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
 class LiveH5Reader(object):
     file = None
     filename = None
@@ -7,43 +15,80 @@ class LiveH5Reader(object):
     next_log_index = None
     target_labels = []
     time_label = 'Collection time'
+    history_index = 0
 
-    def __init__(self, file, target_labels):
+    def __init__(self, file, target_labels, timeout=10, features=None, log_index=None):
         self.file = file
         self.target_labels = target_labels
+        # Optional LogIndex kept up to date with every Status_log line read
+        self.log_index = log_index
+        # Optional ReCIVA_online_preprocessor fed with every row read, placeholder rows included
+        self.features = features
         self.next_data_index = 0
         self.next_log_index = 0
-        self.tol = 10
+        # Rows before history_index are still to be backfilled by read_history. Until they are, rows read for the
+        # features are held back, so the features still see the session in order.
+        self.history_index = 0
+        self.held_entries = []
+        # Seconds without new rows after which the session is considered complete
+        self.timeout = timeout
+        self.last_data_time = time.monotonic()
         self.complete = False
 
+    def poll(self):
+        self.file['Data'].id.refresh()
+        new_entries = self.read_all_data()
+        now = time.monotonic()
+        if len(new_entries) > 0:
+            self.last_data_time = now
+        elif now - self.last_data_time >= self.timeout:
+            self.complete = True
+        return new_entries
 
-
-    def read_data(self):
-        n_times_failed = 0
-        while not self.complete:
-            self.file['Data'].id.refresh()
-            new_entries = self.read_all_data()
-
-            if len(new_entries) == 0:
-                if n_times_failed >= self.tol:
-                    self.complete = True
-                n_times_failed = n_times_failed + 1
-                yield None
-            else:
-                n_times_failed = 0
-                yield new_entries
-
-        return None
+    def columns(self):
+        columns = [self.time_label] + self.target_labels
+        if self.features is not None:
+            columns += [column for column in self.features.columns if column not in columns]
+        return columns
 
     def read_all_data(self):
         dataset = self.file['Data']
         current_len = max(dataset.shape[0], 0)
-        columns = [self.time_label] + self.target_labels
-        new_entries = dataset.fields(columns)[self.next_data_index: max(0, current_len)]
-        new_entries = [dict(zip(columns, entry)) for entry in new_entries]
+        new_entries = dataset.fields(self.columns())[self.next_data_index: max(0, current_len)]
         self.next_data_index = current_len
-        return [entry for entry in new_entries if entry[self.time_label] != 0]
+        self.update_features(new_entries)
+        return new_entries[new_entries[self.time_label] != 0]
 
+    def read_tail(self, n_rows):
+        # Only the last n_rows for now, everything before them is left to read_history
+        self.history_index = max(0, self.file['Data'].shape[0] - n_rows)
+        self.next_data_index = self.history_index
+        return self.read_all_data()
+
+    def read_history(self, n_rows):
+        # The n_rows before those already read, latest first
+        start = max(0, self.history_index - n_rows)
+        chunk = self.file['Data'].fields(self.columns())[start:self.history_index]
+        self.history_index = start
+        if self.features is not None:
+            self.held_entries.insert(0, chunk)
+            if self.history_index == 0:
+                for entries in self.held_entries:
+                    self.features.update(entries)
+                self.held_entries = []
+        return chunk[chunk[self.time_label] != 0]
+
+    def update_features(self, entries):
+        if self.features is not None:
+            if self.history_index > 0:
+                self.held_entries.append(entries)
+            else:
+                self.features.update(entries)
+
+    def read_session(self, session):
+        # Rows already loaded in a SessionData; carry on reading after them
+        self.next_data_index = len(session)
+        return session.rows()
 
     def read_all_logs(self):
         log_list = []
@@ -52,11 +97,166 @@ class LiveH5Reader(object):
             current_len = max(self.file['Status_log'].shape[0], 0)
             log_list.extend(self.file['Status_log'][self.next_log_index:current_len])
             self.next_log_index = current_len
-        log_list = [log.decode('utf-8') for log in log_list]
-        return log_list
+        if self.log_index is not None:
+            # The index parses the lines anyway, its records are handed on so no other consumer parses them again
+            return self.log_index.update(log_list)
+        return [log.decode('utf-8') for log in log_list]
 
 
 
     def terminate(self):
         self.complete=True
 
+
+class PollScheduler(object):
+    def __init__(self, min_interval=0.15, max_interval=2, backoff=1.5, path=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.last_poll = None
+
+        # With a path, the file's modification time is checked every min_interval and a change wakes the poll early
+        self.path = path
+        self.mtime = None
+
+    def due(self):
+        if self.last_poll is None or time.monotonic() - self.last_poll >= self.interval:
+            return True
+        if self.path is not None:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return False
+            if mtime != self.mtime:
+                self.mtime = mtime
+                return True
+        return False
+
+    def update(self, n_rows):
+        self.last_poll = time.monotonic()
+        if n_rows > 0:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def wait_time(self):
+        if self.path is not None or self.last_poll is None:
+            return self.min_interval
+        return max(0, self.last_poll + self.interval - time.monotonic())
+
+
+class AcquisitionThread(threading.Thread):
+    def __init__(self, reader, scheduler=None, max_batches=64, history_chunk_rows=20000):
+        super().__init__(daemon=True)
+        self.reader = reader
+        self.scheduler = scheduler
+        if scheduler is None:
+            self.scheduler = PollScheduler()
+        self.max_batches = max_batches
+        self.history_chunk_rows = history_chunk_rows
+        self.stop_event = threading.Event()
+
+        # Single producer, single consumer: deque appends and pops are atomic, so neither side takes a lock
+        self.batches = deque()
+        self.logs = deque()
+        self.history = deque()
+
+        self.n_batches = 0
+        self.n_rows = 0
+        self.n_history_rows = 0
+        self.n_stalls = 0
+        self.n_read_errors = 0
+        self.max_depth = 0
+        self.read_time = 0
+        # The exception that stopped the thread, if any, for the GUI to report
+        self.error = None
+
+    def run(self):
+        while not self.stop_event.is_set() and (not self.reader.complete or self.reader.history_index > 0):
+            if len(self.batches) >= self.max_batches:
+                # Back-pressure: leave the rows in the file until the GUI catches up
+                self.n_stalls += 1
+                self.stop_event.wait(self.scheduler.min_interval)
+                continue
+            if self.scheduler.due():
+                tic = time.perf_counter()
+                logs = self.read(self.reader.read_all_logs)
+                batch = self.read(self.reader.poll)
+                self.read_time += time.perf_counter() - tic
+
+                if len(logs) > 0:
+                    self.logs.append(logs)
+                if len(batch) > 0:
+                    self.batches.append(batch)
+                    self.n_batches += 1
+                    self.n_rows += len(batch)
+                    self.max_depth = max(self.max_depth, len(self.batches))
+                self.scheduler.update(len(batch))
+            if self.reader.history_index > 0:
+                # Backfill one chunk of history between live polls rather than waiting for the next one
+                tic = time.perf_counter()
+                chunk = self.read(lambda: self.reader.read_history(self.history_chunk_rows))
+                self.read_time += time.perf_counter() - tic
+                if len(chunk) > 0:
+                    self.history.append(chunk)
+                    self.n_history_rows += len(chunk)
+            else:
+                self.stop_event.wait(self.scheduler.wait_time())
+
+    def read(self, read_function):
+        try:
+            return read_function()
+        except OSError:
+            # A read racing the writer's flush can fail; the read indices have not moved, so the next tick retries
+            self.n_read_errors += 1
+            return []
+        except Exception as e:
+            # Anything else would fail again on the next tick, so stop here rather than end as if the session were done
+            self.error = e
+            self.stop_event.set()
+            return []
+
+    def read_data(self):
+        while True:
+            finished = not self.is_alive()
+            batches = self.drain(self.batches)
+            if len(batches) > 0:
+                yield np.concatenate(batches)
+            elif finished and len(self.history) == 0:
+                return None
+            else:
+                yield None
+
+    def read_all_logs(self):
+        logs = self.drain(self.logs)
+        if len(logs) == 0:
+            return []
+        return np.concatenate(logs)
+
+    def read_history(self):
+        return self.drain(self.history)
+
+    def drain(self, items):
+        drained = []
+        while len(items) > 0:
+            drained.append(items.popleft())
+        return drained
+
+    def metrics(self):
+        return {
+            'Queued batches': len(self.batches),
+            'Max queued batches': self.max_depth,
+            'Batches read': self.n_batches,
+            'Rows read': self.n_rows,
+            'History rows read': self.n_history_rows,
+            'Stalls': self.n_stalls,
+            'Read errors': self.n_read_errors,
+            'Read time': self.read_time,
+            'Poll interval': self.scheduler.interval
+        }
+
+    def terminate(self):
+        self.stop_event.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join()
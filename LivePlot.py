@@ -1,12 +1,26 @@
+from collections import deque
+
 import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib import animation
 from matplotlib import patches
-import matplotlib.backends.backend_tkagg
+import matplotlib
+from matplotlib.backend_bases import ResizeEvent
 from matplotlib.backends.backend_pdf import PdfPages
 
 from MetadataExtractor import MetadataExtractor
-
+from SeriesBuffer import SeriesBuffer
+
+colors_map = {
+    'Flow rate L upstream': '#ff7f0e',
+    'Flow rate L downstream': '#2ca02c',
+    'Temperature L upstream': '#d62728',
+    'Temperature L downstream': '#9467bd',
+    'Pressure L upstream': '#8c564b',
+    'Pressure L downstream': '#e377c2',
+    'CO2stream': '#7f7f7f',
+    'Mask pressure': '#bcbd22'
+}
 transform_map = {
     'Pressure': lambda x: x / 1000,
     'Volume': lambda x: x / 1000,
@@ -39,23 +53,33 @@ class LivePlot(object):
 
     fig = None
 
-    x_vals = []
-    y_vals = {}
+    series = None
 
     x_label = None
     y_labels = []
+    visible_labels = []
     y_axes = {}
 
     frame_num = 0
 
     max_interval = 150
 
+    summary_height = 6
+
     n_frames_per_shift = 20
 
+    max_backfill_rows = 5000
+
     x_axis = None
 
     max_x = None
 
+    ani = None
+
+    history = None
+
+    right_adjust_per_axis = 0.06
+
     transform_map = {
         'Accumulated volume L': lambda x: x / 1000,
         'Mask pressure': lambda x: x / 1000,
@@ -63,27 +87,34 @@ class LivePlot(object):
         'Pressure L downstream': lambda x: x / 1000
     }
 
-    def __init__(self, x_label, x_range_limit, y_labels, progress_label, max_progress, colors_map, plot_params=None):
+    def __init__(self, x_label, x_range_limit, y_labels, progress_label, max_progress, colors_map, plot_params=None,
+                 backend='tkagg', blit=False, visible_labels=None):
         self.x_label = x_label
         self.progress_label = progress_label
         self.max_progress = max_progress
         self.y_labels = y_labels.copy()
+        # Every series in y_labels is buffered, only the visible ones are drawn and get an axis
+        self.visible_labels = y_labels.copy()
+        if visible_labels is not None:
+            self.visible_labels = [y_label for y_label in self.y_labels if y_label in visible_labels]
 
         self.x_range_limit = x_range_limit
+        self.blit = blit
 
-        self.x_vals = []
+        # The whole session stays buffered so the 60 s view can be switched off again without re-reading the file
+        self.series = SeriesBuffer(self.y_labels)
         self.y_axes = {}
-        self.y_vals = {}
         self.frame_num = 0
 
         self.colors_map = colors_map
-        self.warnings = []
-        self.errors = []
+        self.warnings = np.empty(0)
+        self.errors = np.empty(0)
 
-        plt.switch_backend('tkagg')
+        plt.switch_backend(backend)
         matplotlib.rcParams.update({'font.size': 14})
         self.fig = plt.figure(figsize=(24,16))
         if plot_params is not None and 'right_adjust_per_axis' in plot_params:
+            self.right_adjust_per_axis = plot_params['right_adjust_per_axis']
             plot_params['right'] = 1 - plot_params['right_adjust_per_axis'] * self.count_axes()
             del plot_params['right_adjust_per_axis']
             self.fig.subplots_adjust(**plot_params)
@@ -96,22 +127,30 @@ class LivePlot(object):
         self.progress.set_xlim(0, 1)
         self.progress.set_ylim(0, 1)
         self.progress.add_patch(patches.Rectangle((0, 0), 1, 1, edgecolor='black', facecolor='lightgrey', clip_on=False))
+        self.progress_bar = patches.Rectangle((0, 0), 0, 1, facecolor='lime', edgecolor='black', zorder=5, visible=False)
+        self.progress.add_patch(self.progress_bar)
         self.progress_text = self.progress.text(.5, 0.5, '0%', zorder=10, ha='center', va='center')
+        self.progress_max = None
 
-        self.pump_indicator = patches.Rectangle((1, 0), 0.035, 1, edgecolor='black', facecolor='red', clip_on=False)
-        self.progress.add_patch(self.pump_indicator)
-        self.pump_text = self.progress.text(1 + 0.035/2, 0.5, 'Pump\nInactive', ha='center', va='center', fontsize=11, clip_on=False)
+        # The pump indicator and timer sit in their own inset axes so that blitting their bounding boxes redraws them
+        self.pump_plot = self.progress.inset_axes([1, 0, 0.035, 1], xticks=[], yticks=[], frame_on=False)
+        self.pump_indicator = patches.Rectangle((0, 0), 1, 1, edgecolor='black', facecolor='red', clip_on=False)
+        self.pump_plot.add_patch(self.pump_indicator)
+        self.pump_text = self.pump_plot.text(0.5, 0.5, 'Pump\nInactive', ha='center', va='center', fontsize=11, clip_on=False)
         self.is_pump_on = False
 
         self.error_plot = self.fig.add_subplot(self.grid[1, 0], xticks=[], yticks=[], frame_on=False, clip_on=False)
         self.error_plot.set_xlim(0, 1)
         self.error_plot.set_ylim(0, 1)
         self.error_plot.add_patch(patches.Rectangle((0, 0), 1, 1, edgecolor='black', facecolor='none', clip_on=False))
-        self.events = []
+        self.events = self.error_plot.eventplot([], colors='orange', linelength=1, lineoffset=0.5, zorder=5)
+        self.events += self.error_plot.eventplot([], colors='red', linelength=1, lineoffset=0.5, clip_on=False, zorder=5)
+        self.events_view = None
 
         self.timer = None
-        self.timer_text = self.error_plot.text(1 + 0.035/2, 0.5, '00:00', ha='center', va='center', fontsize=14, clip_on=False)
-        self.error_plot.add_patch(patches.Rectangle((1, 0), 0.035, 1, edgecolor='black', facecolor='none', clip_on=False))
+        self.timer_plot = self.error_plot.inset_axes([1, 0, 0.035, 1], xticks=[], yticks=[], frame_on=False)
+        self.timer_text = self.timer_plot.text(0.5, 0.5, '00:00', ha='center', va='center', fontsize=14, clip_on=False)
+        self.timer_plot.add_patch(patches.Rectangle((0, 0), 1, 1, edgecolor='black', facecolor='none', clip_on=False))
 
         self.x_axis = self.fig.add_subplot(self.grid[2, 0])
         self.x_axis.set_yticks([])
@@ -119,32 +158,95 @@ class LivePlot(object):
 
         i = 0
         for y_label in y_labels:
-            self.y_vals[y_label] = []
             if y_map[y_label] not in self.y_axes.keys():
                 self.add_axis(y_label, 1 + i * 0.075)
                 i = i + 1
 
+        self.lines = {}
+        for y_label in self.y_labels:
+            name, axis = self.get_axis(y_label)
+            self.lines[y_label], = axis.plot([], [], label=y_label, color=self.colors_map[y_label])
+
+        self.show_visible_labels()
+
+        # Redraw at the right level of detail whenever the toolbar changes the x range. Every y axis shares x with x_axis,
+        # and a change on any of them is reported on all, so x_axis alone hears each change once.
+        self.setting_limits = False
+        self.x_axis.callbacks.connect('xlim_changed', self.on_xlim_changed)
+
+    def on_xlim_changed(self, axis):
+        # initial_frame draws the lines itself once all of its limits are set
+        if not self.setting_limits:
+            self.draw_lines()
+
+    def show_visible_labels(self):
+        visible_axes = [y_map[y_label] for y_label in self.visible_labels]
+        for y_label, line in self.lines.items():
+            line.set_visible(y_label in self.visible_labels)
+        for name, axis in self.y_axes.items():
+            axis.set_visible(name in visible_axes)
+
+    def set_visible_labels(self, visible_labels):
+        # Series are shown and hidden in place, the remaining axes close up from the right edge
+        self.visible_labels = [y_label for y_label in self.y_labels if y_label in visible_labels]
+        self.show_visible_labels()
+        self.fig.subplots_adjust(right=1 - self.right_adjust_per_axis * self.count_axes())
+        self.redraw()
+
+    def set_range_limit(self, x_range_limit):
+        self.x_range_limit = x_range_limit
+        self.events_view = None
+        self.redraw()
+
+    def redraw(self):
+        self.initial_frame()
+        if self.blit:
+            # The saved blitting backgrounds only follow the axis limits, not the layout. Going through the same path
+            # as a window resize makes a running animation drop them and save them again after the next draw.
+            self.fig.canvas.callbacks.process('resize_event', ResizeEvent('resize_event', self.fig.canvas))
+        self.fig.canvas.draw_idle()
+
+    def reset(self):
+        # Return a finished plot to its freshly built state so the figure can be reused for another session
+        self.series.clear()
+        self.progress_max = None
+        self.frame_num = 0
+        self.warnings = np.empty(0)
+        self.errors = np.empty(0)
+        self.events_view = None
+        self.progress_bar.set(width=0, visible=False)
+        self.progress_text.set(text='0%')
+        self.set_pump_indicator(0)
+        self.timer_text.set(text='00:00')
 
-    def initial_data(self, data_list):
-        self.x_vals = [data[self.x_label] / 60 for data in data_list]
+    def initial_data(self, data):
+        self.series.clear()
+        self.progress_max = None
+        self.append_data(data)
 
-        self.y_vals[self.progress_label] = [self.transform(self.progress_label, data[self.progress_label]) for data in data_list]
-        for y_label in self.y_labels:
-            self.y_vals[y_label] = [self.transform(y_label, data[y_label]) for data in data_list]
+    def append_data(self, data):
+        self.series.append(data[self.x_label] / 60,
+                           {y_label: self.transform(y_label, data[y_label]) for y_label in self.y_labels})
+        self.update_progress(self.transform(self.progress_label, data[self.progress_label]))
+
+    def prepend_data(self, data):
+        self.series.prepend(data[self.x_label] / 60,
+                            {y_label: self.transform(y_label, data[y_label]) for y_label in self.y_labels})
+        self.update_progress(self.transform(self.progress_label, data[self.progress_label]))
 
     def initial_frame(self):
         x_end = 0
-        if len(self.x_vals) > 0:
-            x_end = self.x_vals[-1]
+        if len(self.series) > 0:
+            x_end = self.series.x[-1]
 
         axes_done = []
         i = 0
         self.max_x = x_end + self.n_frames_per_shift * self.max_interval / (60*1000)
-        for y_label in self.y_labels:
+        self.setting_limits = True
+        for y_label in self.visible_labels:
             axis_name, y_axis = self.get_axis(y_label)
             if axis_name not in axes_done:
                 axes_done.append(axis_name)
-                y_axis.clear()
                 y_axis.set_xlabel('Time (min)')
                 x_start = 0
                 if self.x_range_limit:
@@ -159,10 +261,13 @@ class LivePlot(object):
                 y_axis.yaxis.set_ticks_position('right')
                 y_axis.spines['right'].set_position(('axes', 1 + i * 0.075))
                 i = i + 1
+        self.setting_limits = False
 
-        lines = self.draw_lines() + self.draw_progress() + self.draw_errors() + [self.timer_text]
+        return self.draw_artists()
 
-        return lines
+    def draw_artists(self):
+        return self.draw_lines() + self.draw_progress() + self.draw_errors() + [self.pump_indicator, self.pump_text,
+                                                                                 self.timer_text]
 
     def transform(self, y_label, val):
         if y_map[y_label] in transform_map.keys():
@@ -172,80 +277,115 @@ class LivePlot(object):
 
     def draw_lines(self):
         lines = []
-        for i, y_label in enumerate(self.y_labels):
-            name, axis = self.get_axis(y_label)
-            try:
-                lines.extend(
-                    axis.plot(self.x_vals, self.y_vals[y_label], label=y_label, color=self.colors_map[y_label]))
-            except ValueError:
-                print(f'Failed with {y_label}, x size {len(self.x_vals)}, y size {(len(self.y_vals[y_label]))}')
+        for y_label in self.y_labels:
+            line = self.lines[y_label]
+            # Hidden lines are still handed to the animation, so they are blitted like the rest once shown again
+            if y_label in self.visible_labels:
+                x_start, x_end = line.axes.get_xlim()
+                line.set_data(*self.series.decimate(y_label, x_start, x_end, max(1, int(line.axes.bbox.width))))
+            lines.append(line)
         return lines
 
     def animate(self, data):
-        lines = []
+        shift = False
+        if self.history is not None:
+            self.backfill()
         if data is not None and len(data) > 0:
-            for point in data:
-                self.x_vals.append(point[self.x_label] / 60)
-                self.y_vals[self.progress_label].append(self.transform(self.progress_label, point[self.progress_label]))
-                for y_label in self.y_labels:
-                    self.y_vals[y_label].append(self.transform(y_label, point[y_label]))
+            self.append_data(data)
 
-            if 'Pump L current' in data[-1]:
-                indicator = self.set_pump_indicator(data[-1]['Pump L current'])
-                if indicator is not None:
-                    lines += indicator
+            if 'Pump L current' in data.dtype.names:
+                self.set_pump_indicator(data['Pump L current'][-1])
 
             self.frame_num = self.frame_num + 1
+            shift = self.frame_num == 1 or self.frame_num % self.n_frames_per_shift == 0
 
-        if self.frame_num == 1 or self.frame_num % self.n_frames_per_shift == 0:
+        if shift:
             lines = self.initial_frame()
+            if self.blit:
+                # The x window moved, so the cached background of every axis is stale
+                self.fig.canvas.draw()
         else:
-            lines = self.draw_lines() + self.draw_progress() + self.draw_errors() + [self.timer_text]
+            lines = self.draw_artists()
 
         return lines
 
+    def update_progress(self, values):
+        if len(values) > 0:
+            batch_max = values.max()
+            if self.progress_max is None or batch_max > self.progress_max:
+                self.progress_max = batch_max
+
     def draw_progress(self):
-        if self.progress_label in self.y_vals and len(self.y_vals[self.progress_label]) > 0:
-            percent = max(self.y_vals[self.progress_label]) / self.max_progress
-            rect = patches.Rectangle((0, 0), percent, 1, facecolor='lime', edgecolor='black', zorder=5)
-            self.progress.add_patch(rect)
+        if self.progress_max is not None:
+            percent = self.progress_max / self.max_progress
+            self.progress_bar.set(width=percent, visible=True)
             self.progress_text.set(text=f'{int(percent * 100)}%')
-            self.progress_text.set(zorder=10)
-            return [rect] + [self.progress_text]
-        return []
+        return [self.progress_bar, self.progress_text]
 
-    def add_errors(self, warnings, errors):
-        self.warnings.extend(warnings)
-        self.errors.extend(errors)
+    def set_errors(self, warnings, errors):
+        self.warnings = np.asarray(warnings, dtype=float)
+        self.errors = np.asarray(errors, dtype=float)
+        self.events_view = None
 
     def draw_errors(self):
-        warnings = []
-        errors = []
+        x_start = 0
         if self.x_range_limit:
             x_start = self.max_x - 1
-            warnings += [(time - x_start) / (self.max_x - x_start) for time in self.warnings if time > x_start]
-            errors += [(time - x_start) / (self.max_x - x_start) for time in self.errors if time > x_start]
-        else:
-            warnings += [time / self.max_x for time in self.warnings]
-            errors += [time / self.max_x for time in self.errors]
-
-
-        for event in self.events:
-            event.remove()
-        self.events = self.error_plot.eventplot(warnings, colors='orange', linelength=1, lineoffset=0.5, zorder=5)
-        self.events += self.error_plot.eventplot(errors , colors='red', linelength=1, lineoffset=0.5, clip_on=False, zorder=5)
+        # The strip only needs rebuilding when events arrive or the x window moves
+        if self.events_view != (x_start, self.max_x):
+            self.events_view = (x_start, self.max_x)
+            warning_events, error_events = self.events
+            warning_events.set_positions(self.window_events(self.warnings, x_start))
+            error_events.set_positions(self.window_events(self.errors, x_start))
         return self.events
 
-    def read(self, generator):
-        self.ani=animation.FuncAnimation(self.fig, self.animate, frames=generator, interval=self.max_interval, repeat=False, init_func=self.initial_frame, cache_frame_data=False)
+    def window_events(self, times, x_start):
+        first = 0
+        if self.x_range_limit:
+            first = np.searchsorted(times, x_start, 'right')
+        return (times[first:] - x_start) / (self.max_x - x_start)
+
+    def backfill(self):
+        # Backfilled history only fills in to the left of what is shown, the x window stays where it is. At most
+        # max_backfill_rows go in per frame, latest first, in one prepend, so the live rows are never held up for long.
+        self.history_chunks.extend(self.history())
+        taken = []
+        n_rows = 0
+        while len(self.history_chunks) > 0 and n_rows < self.max_backfill_rows:
+            chunk = self.history_chunks.popleft()
+            n_take = min(len(chunk), self.max_backfill_rows - n_rows)
+            if n_take < len(chunk):
+                self.history_chunks.appendleft(chunk[:len(chunk) - n_take])
+            taken.append(chunk[len(chunk) - n_take:])
+            n_rows += n_take
+        if n_rows > 0:
+            self.prepend_data(np.concatenate(taken[::-1]))
+
+    def read(self, generator, history=None):
+        # history, if given, returns the chunks of older rows read since the last frame, latest first
+        self.history = history
+        self.history_chunks = deque()
+        self.ani=animation.FuncAnimation(self.fig, self.animate, frames=self.frames(generator), interval=self.max_interval, repeat=False, init_func=self.initial_frame, cache_frame_data=False,
+                                     blit=self.blit)
+
+    def frames(self, generator):
+        yield from generator
+        # History already drained from the reader but not yet merged
+        while self.history is not None and len(self.history_chunks) > 0:
+            yield None
+        if self.blit:
+            # Once the animation stops, hand the moving artists back to regular draws so zooming and resizing keep them
+            for artist in self.draw_artists():
+                artist.set_animated(False)
+            self.fig.canvas.draw_idle()
 
     def get_figure(self):
         return self.fig
 
     def add_axis(self, name, offset):
         x_end = 0
-        if len(self.x_vals) > 0:
-            x_end = self.x_vals[-1]
+        if len(self.series) > 0:
+            x_end = self.series.x[-1]
         self.x_axis.set_xlabel('Time (min)')
         axis = self.x_axis.twinx()
         x_start = 0
@@ -269,7 +409,7 @@ class LivePlot(object):
 
     def count_axes(self):
         axes = []
-        for y_label in self.y_labels:
+        for y_label in self.visible_labels:
             if y_map[y_label] not in axes:
                 axes.append(y_map[y_label])
         return len(axes)
@@ -299,8 +439,8 @@ class LivePlot(object):
         self.increment_timer()
 
     def increment_timer(self):
-        if len(self.x_vals) > 0:
-            time = int(self.x_vals[-1] * 60)
+        if len(self.series) > 0:
+            time = int(self.series.x[-1] * 60)
             self.timer_text.set(text=f'{str(time // 60).zfill(2)}:{str(time % 60).zfill(2)}')
 
     def get_configs(self):
@@ -313,58 +453,53 @@ class LivePlot(object):
         self.stop_timer()
         plt.close(self.fig)
 
-    def save(self, path, file):
-        with PdfPages(path) as pdf:
-            self.ani.to_html5_video()
-            legend = self.fig.legend(loc=(0.05, 0.85 - 0.025 * self.count_axes()))
-            plot_mat = self.fig_to_mat(self.fig)
+    def save(self, path, file, session=None, log_index=None):
+        metadata_extractor = MetadataExtractor()
+        metadata, keys = metadata_extractor.extract(file, session, log_index)
+
+        # Final limits of the series, progress bar and event strip, drawn once by savefig with no animation running
+        self.initial_frame()
+
+        # The report is this figure grown upwards to make room for the summary table, saved as vectors
+        width, height = self.fig.get_size_inches()
+        scale = height / (height + self.summary_height)
+        positions = [(axes, axes.get_position(original=True)) for axes in self.fig.axes]
+        self.fig.set_size_inches(width, height + self.summary_height, forward=False)
+        for axes, position in positions:
+            axes.set_position([position.x0, position.y0 * scale, position.width, position.height * scale])
+        summary = self.add_summary_table(metadata, keys, 1 - scale)
+        legend = self.fig.legend(handles=[self.lines[y_label] for y_label in self.visible_labels], loc=(0.05, (0.85 - 0.025 * self.count_axes()) * scale))
+        # A blitting animation's artists are skipped by regular draws, so they are handed back for this one
+        animated = [artist for artist in self.draw_artists() if artist.get_animated()]
+        for artist in animated:
+            artist.set_animated(False)
+        try:
+            with PdfPages(path) as pdf:
+                pdf.savefig(self.fig, bbox_inches='tight')
+        finally:
+            for artist in animated:
+                artist.set_animated(True)
             legend.remove()
+            summary.remove()
+            for axes, position in positions:
+                axes.set_position(position)
+            self.fig.set_size_inches(width, height, forward=False)
 
-            metadata_extractor = MetadataExtractor()
-            metadata, keys = metadata_extractor.extract(file)
-
-            summary_fig = self.get_summary_fig(metadata, keys)
-            summary_mat = self.fig_to_mat(summary_fig)
-            plt.close(summary_fig)
-
-            fig = plt.figure(num=12, figsize=(24, 16), frameon=False)
-            ax = fig.subplots()
-            ax.xaxis.set_visible(False)
-            ax.yaxis.set_visible(False)
-            ax.spines['top'].set_visible(False)
-            ax.spines['bottom'].set_visible(False)
-            ax.spines['left'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-
-            ax.imshow(np.vstack((summary_mat, plot_mat)))
-            pdf.savefig(fig, bbox_inches='tight')
-            plt.close(fig)
-
-            return metadata
-
-    def fig_to_mat(self, fig):
-        fig.canvas.draw()
-        buf = fig.canvas.tostring_rgb()
-        ncols, nrows = fig.canvas.get_width_height()
-        return np.fromstring(buf, dtype=np.uint8).reshape(nrows, ncols, 3)
+        return metadata
 
-    def get_summary_fig(self, metadata, keys):
+    def add_summary_table(self, metadata, keys, table_fraction):
         table = []
         for key in keys:
-            if key in metadata:
+            if metadata.get(key) is not None:
                 try:
                     table.append([key, '%.2f' % metadata[key]])
                 except:
                     table.append([key, metadata[key]])
             else:
                 table.append([key, ""])
-        fig = plt.figure(num=11, figsize=(24, 6), frameon=False)
-        ax = fig.subplots()
-        ax.xaxis.set_visible(False)
-        ax.yaxis.set_visible(False)
-        ax.spines['top'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        ax.spines['right'].set_visible(False)
+        # Same placement as a default subplot would get in a figure of its own
+        bottom = 1 - table_fraction
+        ax = self.fig.add_axes([0.125, bottom + 0.11 * table_fraction, 0.775, 0.77 * table_fraction], frame_on=False,
+                               xticks=[], yticks=[])
         ax.table(table, bbox=(0, 0.0675, 1, 1))
-        return fig
\ No newline at end of file
+        return ax
@@ -2,8 +2,10 @@ import tkinter as tk
 from datetime import datetime
 
 class LiveTextView(tk.Frame):
-    def __init__(self, master=None):
+    def __init__(self, master=None, max_lines=None):
         super().__init__(master=master)
+        # Oldest lines are dropped once the view holds more than max_lines
+        self.max_lines = max_lines
         self.text = tk.Text(self, font=12, wrap="none", state='disabled', width=24, height=8)
         self.text.tag_config('warning', background='orange')
         self.text.tag_config('error', background='red')
@@ -24,23 +26,7 @@ class LiveTextView(tk.Frame):
 
 
     def add(self, line, log_parser = None):
-        prefix = ''
-        if log_parser is not None:
-            time, msg = log_parser.extract_msg(line)
-            time = log_parser.extract_time(time)
-            prefix = log_parser.get_prefix(time)
-        else:
-            msg = line
-
-        self.text.config(state='normal')
-        tag = self.get_tag(msg)
-
-        if len(prefix) > 0:
-            self.text.insert('end', prefix, tag)
-            self.text.tag_add('time', 'end-1c linestart', 'end-1c lineend')
-
-        self.text.insert('end', f'{msg}\n', tag)
-        self.text.config(state='disabled')
+        self.add_all([line], log_parser)
 
     def get_tag(self, msg):
         if msg.startswith('Warning'):
@@ -52,8 +38,35 @@ class LiveTextView(tk.Frame):
         return None
 
     def add_all(self, lines, log_parser):
-        for line in lines:
-            self.add(line, log_parser)
+        # The whole batch goes in with a single insert, which takes alternating text and tag list arguments
+        if log_parser is not None:
+            records = log_parser.parse(lines)
+            entries = zip([log_parser.get_prefix(time) for time in records['time']], records['msg'],
+                          records['severity'])
+        else:
+            entries = (('', line, self.get_tag(line)) for line in lines)
+
+        chunks = []
+        for prefix, msg, tag in entries:
+            tags = ()
+            if tag:
+                tags = (tag,)
+            if len(prefix) > 0:
+                chunks += [prefix, tags + ('time',)]
+            chunks += [f'{msg}\n', tags]
+
+        if len(chunks) > 0:
+            self.text.config(state='normal')
+            self.text.insert('end', *chunks)
+            self.trim()
+            self.text.config(state='disabled')
+
+    def trim(self):
+        if self.max_lines is not None:
+            # The text always ends in a newline, so the line after it is empty and not counted
+            n_lines = int(self.text.index('end-1c').split('.')[0]) - 1
+            if n_lines > self.max_lines:
+                self.text.delete('1.0', f'{n_lines - self.max_lines + 1}.0')
 
     def clear(self):
         self.text.config(state='normal')
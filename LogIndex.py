@@ -0,0 +1,66 @@
+import threading
+from collections import Counter
+
+import numpy as np
+
+from LogParser import LogParser
+
+
+class LogIndex(object):
+    # What the plot and the report need from a session's Status_log, updated one batch of new lines at a time so
+    # neither has to parse the log again. Event times are kept in epoch seconds, sorted.
+    wait_msg = 'Wait in progress'
+
+    def __init__(self, log_parser=None):
+        self.log_parser = log_parser
+        if log_parser is None:
+            self.log_parser = LogParser()
+        # The reader updates the index from the acquisition thread while the GUI reads it
+        self.lock = threading.Lock()
+        self.initial_time = None
+        self.counts = Counter()
+        self.warning_times = np.empty(0)
+        self.error_times = np.empty(0)
+        self.n_lines = 0
+
+    def update(self, logs):
+        records = self.log_parser.parse(logs)
+        if len(records) == 0:
+            return records
+        timed = ~np.isnan(records['time'])
+        with self.lock:
+            self.log_parser.set_initial_time(records)
+            self.initial_time = self.log_parser.initial_time
+            self.counts.update(records['msg'])
+            self.warning_times = self.merge(self.warning_times,
+                                            records['time'][timed & (records['severity'] == 'warning')])
+            self.error_times = self.merge(self.error_times, records['time'][timed & (records['severity'] == 'error')])
+            self.n_lines += len(records)
+        return records
+
+    def merge(self, times, new_times):
+        if len(new_times) == 0:
+            return times
+        times = np.concatenate((times, new_times))
+        if np.any(np.diff(times) < 0):
+            times = np.sort(times, kind='stable')
+        return times
+
+    def count(self, msg):
+        with self.lock:
+            return self.counts[msg]
+
+    def get_initial_time(self):
+        with self.lock:
+            return self.initial_time
+
+    def get_warnings_and_errors(self):
+        # Minutes since the start of collection, events before it left out
+        with self.lock:
+            if self.initial_time is None:
+                return np.empty(0), np.empty(0)
+            return self.since_start(self.warning_times), self.since_start(self.error_times)
+
+    def since_start(self, times):
+        first = np.searchsorted(times, self.initial_time, 'left')
+        return (times[first:] - self.initial_time) / 60
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class Manifest(object):
+    # Results of earlier batch runs in out_dir, keyed by session path. An entry is reused while the file keeps its size
+    # and modification time, or, when those changed, while its contents still hash the same.
+    filename = 'manifest.json'
+
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, self.filename)
+        self.entries = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def key(self, path):
+        return os.path.abspath(path)
+
+    def get(self, path, field):
+        entry = self.current_entry(path)
+        if entry is None:
+            return None
+        return entry.get(field)
+
+    def current_entry(self, path):
+        entry = self.entries.get(self.key(path))
+        if entry is None or not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        if entry['size'] != stat.st_size:
+            return None
+        if entry['mtime'] != stat.st_mtime_ns:
+            if entry['hash'] != self.hash(path):
+                return None
+            entry['mtime'] = stat.st_mtime_ns
+        return entry
+
+    def update(self, path, **fields):
+        entry = self.current_entry(path)
+        if entry is None:
+            stat = os.stat(path)
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': self.hash(path)}
+            self.entries[self.key(path)] = entry
+        entry.update(fields)
+
+    def hash(self, path):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Written aside and swapped in, so an interrupted run never leaves a truncated manifest behind
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f, default=self.to_json)
+        os.replace(temp_path, self.path)
+
+    def to_json(self, value):
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, bytes):
+            return value.decode('utf-8', errors='replace')
+        raise TypeError(f'{type(value).__name__} is not JSON serializable')
@@ -2,21 +2,37 @@ import re
 import h5py
 import numpy as np
 
-from LogParser import LogParser
+from LogIndex import LogIndex
 
 
 class MetadataExtractor:
+    # Every key extract can return, in the order it returns them
+    columns = [
+        'Collection per tube L', 'Total collection time', 'Patient_ID', 'File_creation_time', 'ReCIVA serial number',
+        'Flow rate upstream average ( >=5)', 'Flow rate downstream average ( >=5)', 'Cycle count',
+        'Warning Left/Right sampling pump flowrate high', 'Warning Left/Right sampling pump flowrate low',
+        'Warning Sampling flow inconsistency downstream >> upstream R581',
+        'Warning Sampling pump exceeding target flow rate flow high R575',
+        'Warning flow rate inconsistency downstream >> upstream', 'Warning flow rate inconsistency upstream >> downstream'
+    ]
+
     def __init__(self):
         pass
 
-    def extract(self, file: h5py.File):
+    def extract(self, file: h5py.File, session=None, log_index=None):
         keys = [
             'Patient_ID', 'ReCIVA serial number', 'File_creation_time', 'Total collection time', 'Collection per tube L',
             'Flow rate upstream average ( >=5)', 'Flow rate downstream average ( >=5)', 'Cycle count',
             'Warning Left/Right sampling pump flowrate high', 'Warning Left/Right sampling pump flowrate low', 'Warning Sampling flow inconsistency downstream >> upstream R581',
             'Warning Sampling pump exceeding target flow rate flow high R575', 'Warning flow rate inconsistency downstream >> upstream'
         ]
-        return {**self.extract_metadata(file), **self.extract_average_flows(file), 'Cycle count': self.extract_cycle_count(file), **self.extract_error_counts(file)}, keys
+        if session is not None:
+            flows = self.flows_from(session.data)
+        else:
+            flows = self.read_flows(file)
+        metadata = {**self.extract_metadata(file), **self.extract_average_flows(file, flows), 'Cycle count': self.extract_cycle_count(file, flows), **self.extract_error_counts(file, log_index)}
+        # Plain values, so a row reads the same whether it was just extracted or reloaded from the batch manifest
+        return {key: plain_value(value) for key, value in metadata.items()}, keys
 
     def extract_metadata(self, file: h5py.File):
         res = {}
@@ -37,7 +53,7 @@ class MetadataExtractor:
                         res[attr] = s
         return res
 
-    def extract_error_counts(self, file: h5py.File):
+    def extract_error_counts(self, file: h5py.File, log_index=None):
         res = {
             'Warning Left/Right sampling pump flowrate high': 0,
             'Warning Left/Right sampling pump flowrate low': 0,
@@ -46,34 +62,76 @@ class MetadataExtractor:
             'Warning flow rate inconsistency downstream >> upstream': 0,
             'Warning flow rate inconsistency upstream >> downstream': 0
         }
-        parser = LogParser()
-        if 'Status_log' in file:
-            for line in file['Status_log']:
-                time, msg = parser.extract_msg(line.decode('utf-8'))
-                if msg in res.keys():
-                    res[msg] += 1
+        if log_index is None and 'Status_log' in file:
+            log_index = LogIndex()
+            log_index.update(file['Status_log'][()])
+        if log_index is not None:
+            for msg in res.keys():
+                res[msg] = log_index.count(msg)
         return res
 
-    def extract_average_flows(self, file: h5py.File):
-        average_up = None
-        average_down = None
+    def read_flows(self, file: h5py.File):
         if 'Data' in file and 'Flow rate L upstream' in file['Data'].dtype.names and 'Flow rate L downstream' in file['Data'].dtype.names:
-            data = np.array([tuple(pair) for pair in file['Data'].fields(['Flow rate L upstream', 'Flow rate L downstream'])]).T
+            return self.flows_from(file['Data'].fields(['Flow rate L upstream', 'Flow rate L downstream'])[()])
+        return None
 
-            if len(data.shape) > 1 and data.shape[1] > 0:
-                average_up = np.mean(data[0, data[0, :] >= 5])
-                average_down = np.mean(data[1, data[1, :] >= 5])
+    def flows_from(self, data):
+        names = data.dtype.names or ()
+        if 'Flow rate L upstream' in names and 'Flow rate L downstream' in names:
+            up = data['Flow rate L upstream']
+            down = data['Flow rate L downstream']
+            dtype = np.result_type(up.dtype, down.dtype)
+            return up.astype(dtype, copy=False), down.astype(dtype, copy=False)
+        return None
+
+    def extract_average_flows(self, file: h5py.File, flows=None):
+        average_up = None
+        average_down = None
+        if flows is None:
+            flows = self.read_flows(file)
+        if flows is not None:
+            up, down = flows
+            if len(up) > 0:
+                average_up = np.mean(up[up >= 5])
+                average_down = np.mean(down[down >= 5])
         return {'Flow rate upstream average ( >=5)': average_up, 'Flow rate downstream average ( >=5)': average_down}
 
-    def extract_cycle_count(self, file: h5py.File):
+    def extract_cycle_count(self, file: h5py.File, flows=None):
         count = 0
-        if 'Data' in file and 'Flow rate L upstream' in file['Data'].dtype.names and 'Flow rate L downstream' in file['Data'].dtype.names:
-            n_measurements_active = 0
-            for up, down in file['Data'].fields(['Flow rate L upstream', 'Flow rate L downstream']):
-                flow = max(up, down)
-                if flow < 20 and n_measurements_active >= 5:
-                    count += 1
-                    n_measurements_active = 0
-                elif flow >= 100:
-                    n_measurements_active += 1
+        if flows is None:
+            flows = self.read_flows(file)
+        if flows is not None:
+            up, down = flows
+            # A cycle is counted when the flow drops below 20 after at least 5 measurements at 100 or more since the
+            # last counted cycle. Only the first measurement of each run below 20 can close a cycle.
+            flow = np.where(down > up, down, up)
+            active = flow >= 100
+            low = flow < 20
+            drops = np.flatnonzero(low & ~np.concatenate(([False], low[:-1])))
+            n_active_before_drop = np.cumsum(active)[drops]
+
+            n_active_at_last_cycle = 0
+            while True:
+                drop = np.searchsorted(n_active_before_drop, n_active_at_last_cycle + 5)
+                if drop >= len(drops):
+                    break
+                count += 1
+                n_active_at_last_cycle = n_active_before_drop[drop]
         return count
+
+
+def plain_value(value):
+    # numpy scalars and h5py attributes as the plain Python values they hold, and NaN as None, which neither JSON nor a
+    # spreadsheet cell has a number for. A float32 becomes the shortest float that reads back as the same float32, 1.1
+    # rather than 1.100000023841858, which is what it prints as before and after a round trip through JSON.
+    if isinstance(value, np.ndarray):
+        return [plain_value(item) for item in value]
+    if isinstance(value, np.floating):
+        value = float(str(value))
+    elif isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
@@ -0,0 +1,183 @@
+import numpy as np
+
+
+class SeriesBuffer(object):
+    lod_factor = 2
+
+    def __init__(self, labels, capacity=4096):
+        self.labels = list(labels)
+        self.index = {label: i + 1 for i, label in enumerate(self.labels)}
+        # Row 0 holds the x values, every other row one series, so each series is a contiguous slice. The rows live in
+        # columns start to end, with spare room on both sides for appending and for prepending history.
+        self.data = np.empty((len(self.labels) + 1, capacity))
+        self.start = 0
+        self.end = 0
+        # Samples are numbered from the first one appended, history prepended later counts down from -1. Sample s is
+        # in column origin + s.
+        self.origin = 0
+        # levels[k] holds, for every bucket of lod_factor ** (k + 1) samples, the sample numbers of each series'
+        # minimum (row 2 * i) and maximum (row 2 * i + 1). Buckets are aligned to sample 0, so neither appending nor
+        # prepending moves them. level_ranges[k] are the complete buckets, level_offsets[k] the bucket in column 0.
+        self.levels = []
+        self.level_offsets = []
+        self.level_ranges = []
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, label):
+        return self.data[self.index[label], self.start:self.end]
+
+    @property
+    def x(self):
+        return self.data[0, self.start:self.end]
+
+    def clear(self):
+        self.start = 0
+        self.end = 0
+        self.origin = 0
+        self.levels = []
+        self.level_offsets = []
+        self.level_ranges = []
+
+    def append(self, x, columns):
+        n = len(x)
+        if n == 0:
+            return
+        if self.end + n > self.data.shape[1]:
+            self.make_room(0, n)
+
+        self.data[0, self.end:self.end + n] = x
+        for label, values in columns.items():
+            self.data[self.index[label], self.end:self.end + n] = values
+        self.end += n
+        self.update_levels()
+
+    def prepend(self, x, columns):
+        # Rows older than everything buffered, e.g. history read after the tail of a session
+        n = len(x)
+        if n == 0:
+            return
+        if self.start < n:
+            self.make_room(n, 0)
+
+        self.data[0, self.start - n:self.start] = x
+        for label, values in columns.items():
+            self.data[self.index[label], self.start - n:self.start] = values
+        self.start -= n
+        self.update_levels()
+
+    def make_room(self, front, back):
+        # Whichever side is short gets room for the new rows plus as many again as are buffered, so growing either way
+        # copies each row a bounded number of times
+        size = len(self)
+        head = self.start
+        tail = self.data.shape[1] - self.end
+        if front > head:
+            head = front + size
+        if back > tail:
+            tail = back + size
+        data = np.empty((self.data.shape[0], head + size + tail))
+        data[:, head:head + size] = self.data[:, self.start:self.end]
+        self.data = data
+        self.origin += head - self.start
+        self.start = head
+        self.end = head + size
+
+    def update_levels(self):
+        factor = self.lod_factor
+        # Complete buckets of level 0, then of each level from the one below
+        first = -(-(self.start - self.origin) // factor)
+        last = (self.end - self.origin) // factor
+        k = 0
+        while last > first:
+            if k == len(self.levels):
+                self.levels.append(np.empty((2 * len(self.labels), max(16, last - first)), dtype=np.int64))
+                self.level_offsets.append(first)
+                self.level_ranges.append((first, first))
+            done_first, done_last = self.level_ranges[k]
+            if done_first == done_last:
+                done_first, done_last = first, first
+            self.reserve_level(k, first, last)
+            # Only the buckets completed since the last update, at either end
+            if first < done_first:
+                self.fill_level(k, first, done_first)
+            if last > done_last:
+                self.fill_level(k, max(first, done_last), last)
+            self.level_ranges[k] = (first, last)
+
+            first = -(-first // factor)
+            last = last // factor
+            k += 1
+
+    def reserve_level(self, k, first, last):
+        level = self.levels[k]
+        offset = self.level_offsets[k]
+        width = level.shape[1]
+        if first >= offset and last <= offset + width:
+            return
+        new_offset = offset
+        if first < offset:
+            new_offset = first - width
+        new_end = offset + width
+        if last > new_end:
+            new_end = last + width
+        new_level = np.empty((level.shape[0], new_end - new_offset), dtype=np.int64)
+        done_first, done_last = self.level_ranges[k]
+        new_level[:, done_first - new_offset:done_last - new_offset] = level[:, done_first - offset:done_last - offset]
+        self.levels[k] = new_level
+        self.level_offsets[k] = new_offset
+
+    def fill_level(self, k, first, last):
+        factor = self.lod_factor
+        level = self.levels[k]
+        offset = self.level_offsets[k]
+        rows = np.arange(last - first)
+        for i in range(len(self.labels)):
+            y = self.data[i + 1]
+            if k == 0:
+                candidates = np.arange(first * factor, last * factor).reshape(-1, factor)
+                lows = candidates
+                highs = candidates
+            else:
+                below = self.levels[k - 1]
+                below_offset = self.level_offsets[k - 1]
+                lows = below[2 * i, first * factor - below_offset:last * factor - below_offset].reshape(-1, factor)
+                highs = below[2 * i + 1, first * factor - below_offset:last * factor - below_offset].reshape(-1, factor)
+            level[2 * i, first - offset:last - offset] = lows[rows, np.argmin(y[self.origin + lows], axis=1)]
+            level[2 * i + 1, first - offset:last - offset] = highs[rows, np.argmax(y[self.origin + highs], axis=1)]
+
+    def decimate(self, label, x_start, x_end, n_points):
+        x = self.x
+        y = self[label]
+        lo = max(0, int(np.searchsorted(x, x_start, 'left')) - 1)
+        hi = min(len(x), int(np.searchsorted(x, x_end, 'right')) + 1)
+        count = hi - lo
+        k = 0
+        if count > 2 * n_points:
+            # Finest level with at most one bucket, so a minimum and a maximum, per pixel
+            k = min(int(np.ceil(np.log(count / n_points) / np.log(self.lod_factor))), len(self.levels))
+        if k == 0:
+            return x[lo:hi], y[lo:hi]
+
+        bucket = self.lod_factor ** k
+        # Sample number of x[0]
+        base = self.start - self.origin
+        done_first, done_last = self.level_ranges[k - 1]
+        first = max((base + lo) // bucket, done_first)
+        last = min(-(-(base + hi) // bucket), done_last)
+        if first >= last:
+            return x[lo:hi], y[lo:hi]
+
+        i = self.index[label] - 1
+        offset = self.level_offsets[k - 1]
+        lows = self.levels[k - 1][2 * i, first - offset:last - offset]
+        highs = self.levels[k - 1][2 * i + 1, first - offset:last - offset]
+        # Emit each bucket's extremes in time order so the envelope is drawn left to right
+        indices = np.stack((np.minimum(lows, highs), np.maximum(lows, highs)), axis=1).ravel() - base
+        # Samples outside the complete buckets, at the edges of the buffer, are drawn as they are
+        if first * bucket > base + lo:
+            indices = np.concatenate((np.arange(lo, first * bucket - base), indices))
+        if base + hi > last * bucket:
+            indices = np.concatenate((indices, np.arange(max(lo, last * bucket - base), hi)))
+        return x[indices], y[indices]
@@ -0,0 +1,34 @@
+import h5py
+import numpy as np
+import pandas as pd
+
+
+class SessionData(object):
+    time_label = 'Collection time'
+
+    def __init__(self, file: h5py.File):
+        self.data = np.empty(0)
+        if 'Data' in file:
+            dataset = file['Data']
+            # One read of the whole compound dataset: HDF5 walks it chunk by chunk straight into this buffer
+            self.data = np.empty(dataset.shape, dtype=dataset.dtype)
+            if len(self.data) > 0:
+                dataset.read_direct(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, name):
+        return self.data.dtype.names is not None and name in self.data.dtype.names
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def rows(self):
+        if len(self.data) == 0 or np.all(self.data[self.time_label] != 0):
+            return self.data
+        return self.data[self.data[self.time_label] != 0]
+
+    def to_frame(self):
+        names = self.data.dtype.names or ()
+        return pd.DataFrame({name: self.data[name] for name in names})
@@ -0,0 +1,121 @@
+from pdfrw import PdfReader, PdfDict, PdfObject, IndirectPdfDict, PdfString
+
+
+class StreamingPdfMerger(object):
+    # Appends the pages of one PDF at a time straight to the output file. After each append the file is closed off
+    # with an incremental update (a new catalog, page tree and cross-reference section), so it is a complete PDF at
+    # every step and only the PDF being appended is ever held in memory.
+    catalog_ref = '1 0 R'
+    pages_ref = '2 0 R'
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.kids = []
+        self.offsets = {}
+        self.next_objnum = 3
+        self.last_xref = None
+        self.indirect = {}
+
+        self.write('%PDF-1.3\n%\xe2\xe3\xcf\xd3\n')
+        self.update()
+
+    def write(self, s):
+        self.file.write(s.encode('latin-1'))
+
+    def add_pdf(self, path):
+        for page in PdfReader(path).pages:
+            inheritable = page.inheritable
+            new_page = IndirectPdfDict(page, Resources=inheritable.Resources, MediaBox=inheritable.MediaBox,
+                                       CropBox=inheritable.CropBox, Rotate=inheritable.Rotate)
+            new_page.Parent = PdfObject(self.pages_ref)
+
+            # Anything still pointing at the old page or its page tree is redirected to the new ones
+            objnum = self.next_objnum
+            self.next_objnum += 1
+            self.indirect[id(page)] = objnum
+            self.indirect[id(new_page)] = objnum
+            parent = page.Parent
+            while parent is not None:
+                self.indirect[id(parent)] = 2
+                parent = parent.Parent
+
+            self.write_object(objnum, self.format(new_page))
+            self.kids.append(f'{objnum} 0 R')
+        # Objects are never shared across input files, so their numbering can be forgotten once a file is written
+        self.indirect = {}
+        self.update()
+
+    def add(self, obj):
+        if isinstance(obj, PdfDict):
+            indirect = obj.indirect or obj.stream is not None
+        else:
+            indirect = getattr(obj, 'indirect', False)
+        if not indirect:
+            return self.format(obj)
+
+        objnum = self.indirect.get(id(obj))
+        if objnum is None:
+            objnum = self.next_objnum
+            self.next_objnum += 1
+            self.indirect[id(obj)] = objnum
+            # Formatting writes any new objects this one refers to, so the offset is taken after it
+            formatted = self.format(obj)
+            self.write_object(objnum, formatted)
+        return f'{objnum} 0 R'
+
+    def format(self, obj):
+        if isinstance(obj, (list, tuple)):
+            return '[%s]' % ' '.join(self.add(x) for x in obj)
+        if isinstance(obj, dict):
+            if not isinstance(obj, PdfDict):
+                obj = PdfDict(obj)
+            pairs = sorted((getattr(key, 'encoded', None) or key, value) for key, value in obj.iteritems())
+            result = '<<%s>>' % ' '.join(f'{key} {self.add(value)}' for key, value in pairs)
+            if obj.stream is not None:
+                result = f'{result}\nstream\n{obj.stream}\nendstream'
+            return result
+        if hasattr(obj, 'indirect'):
+            return str(getattr(obj, 'encoded', None) or obj)
+        if isinstance(obj, (str, bytes)):
+            return PdfString.encode(obj)
+        if isinstance(obj, float):
+            # PDF has no exponent notation
+            return ('%.9f' % obj).rstrip('0').rstrip('.')
+        return str(obj)
+
+    def write_object(self, objnum, formatted):
+        self.offsets[objnum] = self.file.tell()
+        self.write(f'{objnum} 0 obj\n{formatted}\nendobj\n')
+
+    def update(self):
+        self.write_object(2, f'<</Count {len(self.kids)} /Kids [{" ".join(self.kids)}] /Type /Pages>>')
+        self.write_object(1, f'<</Pages {self.pages_ref} /Type /Catalog>>')
+
+        xref = self.file.tell()
+        self.write('xref\n')
+        objnums = sorted(self.offsets)
+        if self.last_xref is None:
+            objnums = [0] + objnums
+        # One subsection per run of consecutive object numbers
+        start = 0
+        for i in range(1, len(objnums) + 1):
+            if i == len(objnums) or objnums[i] != objnums[i - 1] + 1:
+                self.write(f'{objnums[start]} {i - start}\n')
+                for objnum in objnums[start:i]:
+                    if objnum == 0:
+                        self.write('0000000000 65535 f\r\n')
+                    else:
+                        self.write('%010d 00000 n\r\n' % self.offsets[objnum])
+                start = i
+
+        trailer = f'/Root {self.catalog_ref} /Size {self.next_objnum}'
+        if self.last_xref is not None:
+            trailer += f' /Prev {self.last_xref}'
+        self.write(f'trailer\n<<{trailer}>>\nstartxref\n{xref}\n%%EOF\n')
+        self.file.flush()
+
+        self.last_xref = xref
+        self.offsets = {}
+
+    def close(self):
+        self.file.close()
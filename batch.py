@@ -0,0 +1,118 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+import _pickle as pickle
+from multiprocessing import freeze_support
+
+from BatchProcessor import BatchProcessor
+from LivePlot import colors_map
+from MetadataExtractor import plain_value
+
+
+def find_sessions(inputs):
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.h5')
+        for path in sorted(glob.glob(pattern)):
+            if path.endswith('.h5') and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def load_model(model_path):
+    model = None
+    if model_path is not None and os.path.isfile(model_path):
+        with open(model_path, 'rb') as file:
+            try:
+                model = pickle.load(file)
+            except:
+                pass
+    return model
+
+
+def write_results(out_dir, paths, metadata, scores, model):
+    rows = []
+    for i, path in enumerate(paths):
+        row = {'Path': path, 'File': os.path.splitext(os.path.basename(path))[0]}
+        if scores is not None:
+            row['Score'] = plain_value(float(scores[i]))
+            row['Accepted'] = bool(scores[i] <= model.threshold_90)
+        if metadata is not None:
+            if type(metadata[i]) == str:
+                row['Error'] = metadata[i]
+            else:
+                row = {**row, **{key: plain_value(value) for key, value in metadata[i].items()}}
+        rows.append(row)
+
+    with open(os.path.join(out_dir, 'results.json'), 'w') as f:
+        json.dump(rows, f, indent=1, allow_nan=False)
+
+    fieldnames = []
+    for row in rows:
+        fieldnames += [key for key in row if key not in fieldnames]
+    with open(os.path.join(out_dir, 'results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score sessions and write their reports without the GUI.')
+    parser.add_argument('inputs', nargs='+', help='directories or glob patterns of .h5 session files')
+    parser.add_argument('-o', '--output', help='output directory (default: output_directory in config.json)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('-t', '--targets', nargs='+', default=['Flow rate L upstream', 'Flow rate L downstream'],
+                        help='series to plot')
+    parser.add_argument('-c', '--config', default='config.json', help='configuration file')
+    parser.add_argument('--no-plots', action='store_true', help='skip the PDF reports and metadata summary')
+    parser.add_argument('--no-scores', action='store_true', help='skip model scoring')
+    args = parser.parse_args()
+
+    config = {}
+    if os.path.isfile(args.config):
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+    out_dir = args.output or config.get('output_directory', 'Output')
+    os.makedirs(out_dir, exist_ok=True)
+
+    paths = find_sessions(args.inputs)
+    if len(paths) == 0:
+        print('Error: no .h5 files found')
+        return 1
+
+    model = None
+    if not args.no_scores:
+        model = load_model(config.get('model_path', 'model.pkl'))
+        if model is None:
+            print('Warning: no model found, check \'model_path\' in config.json; skipping scores')
+
+    processor = BatchProcessor(out_dir, colors_map, model=model, n_workers=args.workers, log=print)
+    print(f'{len(paths)} files, {processor.n_workers} workers')
+    tic = time.perf_counter()
+    try:
+        metadata = None
+        if not args.no_plots:
+            metadata = processor.plot_files(paths, args.targets, config.get('plot_params'))
+        scores = None
+        if model is not None:
+            scores = processor.score_files(paths)
+    finally:
+        processor.close()
+
+    write_results(out_dir, paths, metadata, scores, model)
+    elapsed = time.perf_counter() - tic
+    print(f'Finished {len(paths)} files in {elapsed:.1f} s ({len(paths) / elapsed:.2f} files/s), '
+          f'results saved to {out_dir}')
+    if scores is not None:
+        n_rejected = sum(1 for score in scores if score > model.threshold_90)
+        print(f'{len(paths) - n_rejected} accepted, {n_rejected} rejected at 90% significance level')
+    return 0
+
+
+if __name__ == '__main__':
+    freeze_support()
+    raise SystemExit(main())
@@ -0,0 +1,296 @@
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from BatchProcessor import plot_file, plot_indexed_file, init_plot_worker
+from LivePlot import LivePlot, colors_map
+from LogIndex import LogIndex
+from LogParser import LogParser
+from preprocessing import ReCIVA_log_preprocessor, ReCIVA_online_preprocessor
+
+fields = [
+    'Collection time', 'Flow rate L upstream', 'Flow rate L downstream', 'Temperature L upstream',
+    'Temperature L downstream', 'Pressure L upstream', 'Pressure L downstream', 'CO2stream', 'Mask pressure',
+    'Pump L current', 'Accumulated volume L', 'Voltage L', 'Pump L training current', 'Pump L live voltage'
+]
+
+
+def synthetic_session(minutes, rate=10, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(minutes * 60 * rate)
+    t = np.arange(1, n + 1) / rate
+    active = np.sin(t / 3) > 0.2
+
+    data = np.zeros(n, dtype=[(field, 'f4') for field in fields])
+    data['Collection time'] = t
+    data['Flow rate L upstream'] = np.where(active, 150 + rng.normal(0, 5, n), 0)
+    data['Flow rate L downstream'] = np.where(active, 145 + rng.normal(0, 5, n), rng.uniform(0, 3, n))
+    data['Temperature L upstream'] = 30 + rng.normal(0, 1, n)
+    data['Temperature L downstream'] = 31 + rng.normal(0, 1, n)
+    data['Pressure L upstream'] = 100000 + rng.normal(0, 1000, n)
+    data['Pressure L downstream'] = 101000 + rng.normal(0, 1000, n)
+    data['CO2stream'] = 20000 * (1 + np.sin(t)) + rng.normal(0, 100, n)
+    data['Mask pressure'] = rng.normal(100000, 100, n)
+    data['Pump L current'] = np.where(active, 60, 10)
+    data['Accumulated volume L'] = np.cumsum(active) * 0.05 / rate
+    data['Voltage L'] = 5
+    data['Pump L training current'] = rng.normal(1, 0.1, n)
+    data['Pump L live voltage'] = rng.normal(3, 0.1, n)
+    return data
+
+
+def frame_liveplot(targets):
+    liveplot = LivePlot('Collection time', False, targets, 'Accumulated volume L', 1, colors_map=colors_map,
+                        backend='agg')
+    liveplot.initial_data(synthetic_session(0))
+    liveplot.initial_frame()
+    return liveplot
+
+
+def benchmark_frames(minutes=25, rows_per_frame=2, sample_frames=50, n_checkpoints=4):
+    targets = ['Flow rate L upstream', 'Flow rate L downstream']
+    data = synthetic_session(minutes)
+    liveplot = frame_liveplot(targets)
+    width = int(liveplot.lines[targets[0]].axes.bbox.width)
+
+    # The sample_frames frames before each checkpoint are drawn and timed
+    canvas = liveplot.get_figure().canvas
+    starts = range(0, len(data), rows_per_frame)
+    checkpoints = [len(starts) * (i + 1) // n_checkpoints for i in range(n_checkpoints)]
+    update_costs = []
+    frame_costs = []
+    points = []
+    update_times = []
+    frame_times = []
+    for i, start in enumerate(starts):
+        tic = time.perf_counter()
+        liveplot.animate(data[start:start + rows_per_frame])
+        if any(checkpoint - sample_frames <= i < checkpoint for checkpoint in checkpoints):
+            update_times.append(time.perf_counter() - tic)
+            canvas.draw()
+            frame_times.append(time.perf_counter() - tic)
+        if i + 1 in checkpoints:
+            update_costs.append(np.median(update_times))
+            frame_costs.append(np.median(frame_times))
+            points.append(max(len(line.get_xdata()) for line in liveplot.lines.values()))
+            update_times = []
+            frame_times = []
+    liveplot.close()
+
+    for checkpoint, update_cost, frame_cost, n_points in zip(checkpoints, update_costs, frame_costs, points):
+        print(f'{checkpoint * rows_per_frame / 600:.1f} min: update {update_cost * 1000:.2f} ms, '
+              f'update and draw {frame_cost * 1000:.1f} ms, {n_points} points per line on {width} px')
+    # What grows with the session is the data behind each frame: the update has to stay flat, and decimation has to
+    # keep at most a minimum and a maximum per pixel, plus the buckets cut by the axis edges. Agg's draw time on top
+    # follows how much of the plot the lines cover, which levels off once the envelope is filled in.
+    if max(points) > 2 * width + 8:
+        raise AssertionError(f'{max(points)} points drawn per line on {width} px')
+    if update_costs[-1] > 2 * update_costs[0] + 0.001:
+        raise AssertionError(f'update cost grew from {update_costs[0] * 1000:.2f} ms to '
+                             f'{update_costs[-1] * 1000:.2f} ms')
+
+
+def synthetic_logs(n_lines, seed=0):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2024-01-01T09:00:00')
+    messages = ['Status: sampling in progress', 'Warning: Left/Right sampling pump flowrate high',
+                'Error: [Pump] over-current (R575)', 'Success: bag filled', 'Status: note, with a comma']
+    logs = [f'{start}+00:00, Status: Wait in progress']
+    for i in range(1, n_lines):
+        logs.append(f'{start + np.timedelta64(i, "s")}+00:00, {messages[rng.integers(len(messages))]}')
+    return [log.encode('utf-8') for log in logs]
+
+
+def benchmark_log_parser(n_lines=20000):
+    logs = synthetic_logs(n_lines)
+
+    # What every consumer used to do on its own: decode, split and strptime each line
+    tic = time.perf_counter()
+    reference = LogParser()
+    lines = [log.decode('utf-8') for log in logs]
+    for line in lines:
+        t, msg = reference.extract_msg(line)
+        if 'Wait in progress' in line:
+            reference.initial_time = reference.extract_time(t)
+    rows = []
+    for line in lines:
+        t, msg = reference.extract_msg(line)
+        t = reference.extract_time(t)
+        rows.append(((t - reference.initial_time).total_seconds() / 60, msg))
+    per_line_time = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    log_index = LogIndex()
+    records = log_index.update(logs)
+    warnings, errors = log_index.get_warnings_and_errors()
+    bulk_time = time.perf_counter() - tic
+
+    expected_warnings = [m for m, msg in rows if msg.startswith('Warning')]
+    expected_errors = [m for m, msg in rows if msg.startswith('Error')]
+    if list(records['msg']) != [msg for _, msg in rows] or not np.allclose(warnings, expected_warnings) or \
+            not np.allclose(errors, expected_errors):
+        raise AssertionError('bulk parse differs from the per-line parse')
+    print(f'{n_lines} log lines: per line {per_line_time * 1000:.1f} ms, bulk parse {bulk_time * 1000:.1f} ms')
+
+
+class ReferencePreprocessor(ReCIVA_log_preprocessor):
+    # The original loop-based interval detection, kept to check the vectorized version against
+    def extract_flow_intervals(self, flow_array, time_array):
+        flow_exists_array = flow_array > 0.01
+        flow_not_exists_array = np.logical_not(flow_exists_array)
+        flows = []
+        index = 0
+        while index < len(flow_array):
+            starts = np.argwhere(flow_exists_array[index:])
+            if len(starts) > 0:
+                start = starts[0][0] + index
+                ends = np.argwhere(flow_not_exists_array[start:])
+                if len(ends) > 0:
+                    end = ends[0][0] + start
+                    flows.append((start, end))
+                    index = end
+                else:
+                    break
+            else:
+                break
+        return np.array([time_array[flow[1]] - time_array[flow[0]] for flow in flows])
+
+
+def load_as_df(path):
+    with h5py.File(path, 'r', libver='latest', locking=False) as file:
+        data = file['Data'][()]
+    return pd.DataFrame({attr: data[attr] for attr in data.dtype.names})
+
+
+def check_features(df):
+    expected = ReferencePreprocessor().extract_features(df, extra=True)
+    features = ReCIVA_log_preprocessor().extract_features(df, extra=True)
+    mismatched = [key for key in expected if not np.array_equal(expected[key], features[key], equal_nan=True)]
+    if len(mismatched) > 0 or expected.keys() != features.keys():
+        raise AssertionError(f'Features differ from the reference implementation: {mismatched}')
+
+
+def benchmark_flow_intervals(paths, hours=4):
+    for path in paths:
+        check_features(load_as_df(path))
+        print(f'{path}: features identical to the reference implementation')
+
+    data = synthetic_session(hours * 60)
+    check_features(pd.DataFrame({field: data[field] for field in fields}))
+
+    flow = data['Flow rate L upstream']
+    t = data['Collection time']
+    for name, preprocessor in [('loop', ReferencePreprocessor()), ('vectorized', ReCIVA_log_preprocessor())]:
+        tic = time.perf_counter()
+        intervals = preprocessor.extract_flow_intervals(flow, t)
+        elapsed = time.perf_counter() - tic
+        print(f'extract_flow_intervals ({name}) on {hours} h, {len(flow)} rows, {len(intervals)} flows: '
+              f'{elapsed * 1000:.1f} ms')
+
+
+def benchmark_online_features(paths, batch_rows=20):
+    sessions = [(path, load_as_df(path)) for path in paths]
+    data = synthetic_session(60)
+    sessions.append(('synthetic 60 min', pd.DataFrame({field: data[field] for field in fields})))
+
+    for name, df in sessions:
+        rows = df.to_records(index=False)
+        features = ReCIVA_online_preprocessor()
+        tic = time.perf_counter()
+        for start in range(0, len(rows), batch_rows):
+            features.update(rows[start:start + batch_rows])
+        update_time = time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        online = features.current_features(extra=True)
+        score_time = time.perf_counter() - tic
+        tic = time.perf_counter()
+        expected = ReCIVA_log_preprocessor().extract_features(df, extra=True)
+        batch_time = time.perf_counter() - tic
+
+        mismatched = [key for key in expected if not np.isclose(expected[key], online[key], rtol=1e-5, equal_nan=True)]
+        if len(mismatched) > 0 or list(expected) != list(online):
+            raise AssertionError(f'{name}: online features differ from extract_features: {mismatched}')
+        print(f'{name}: {len(rows)} rows, online features match; update {update_time / len(rows) * 1e6:.2f} us/row, '
+              f'snapshot {score_time * 1000:.1f} ms, batch extract_features {batch_time * 1000:.1f} ms')
+
+
+def write_session(path, data, logs=()):
+    with h5py.File(path, 'w', libver='latest') as file:
+        file.create_dataset('Data', data=data, maxshape=(None,), chunks=True)
+        file.create_dataset('Status_log', data=np.array(logs, dtype=h5py.string_dtype()), maxshape=(None,))
+
+
+def benchmark_plot_pool(paths, n_files=100, minutes=25):
+    targets = ['Flow rate L upstream', 'Flow rate L downstream']
+    work_dir = tempfile.mkdtemp()
+    try:
+        if len(paths) == 0:
+            paths = [os.path.join(work_dir, 'synthetic.h5')]
+            write_session(paths[0], synthetic_session(minutes))
+        inputs = []
+        for i in range(n_files):
+            inputs.append(os.path.join(work_dir, f'session_{i:03d}.h5'))
+            shutil.copy(paths[i % len(paths)], inputs[-1])
+        out_dir = os.path.join(work_dir, 'out')
+        args_list = [(path, targets, None, colors_map, LogParser(), out_dir) for path in inputs]
+
+        def report(name, elapsed, results):
+            failed = [r for r in results if type(r) == str]
+            print(f'{name}: {n_files} files in {elapsed:.1f} s, {n_files / elapsed:.2f} files/s, {len(failed)} failed')
+            if len(failed) > 0:
+                print(f'  first failure: {failed[0]}')
+
+        # What every Plot click used to do: a fresh 16-process pool, one new interpreter per file
+        tic = time.perf_counter()
+        with multiprocessing.Pool(16, maxtasksperchild=1) as pool:
+            results = pool.starmap(plot_file, args_list)
+        report('per-click pool, maxtasksperchild=1', time.perf_counter() - tic, results)
+
+        pool = multiprocessing.Pool(multiprocessing.cpu_count(), initializer=init_plot_worker)
+        for click in ['first', 'second']:
+            tic = time.perf_counter()
+            results = [result for _, result in pool.imap_unordered(plot_indexed_file, enumerate(args_list))]
+            report(f'persistent pool ({multiprocessing.cpu_count()} workers), {click} click',
+                   time.perf_counter() - tic, results)
+        pool.terminate()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    name = 'frames'
+    args = sys.argv[1:]
+    if len(args) > 0:
+        name, args = args[0], args[1:]
+
+    if name == 'frames':
+        minutes = 25
+        if len(args) > 0:
+            minutes = float(args[0])
+        benchmark_frames(minutes)
+    elif name == 'flow':
+        benchmark_flow_intervals(args)
+    elif name == 'features':
+        benchmark_online_features(args)
+    elif name == 'pool':
+        n_files = 100
+        if len(args) > 0 and args[0].isdigit():
+            n_files, args = int(args[0]), args[1:]
+        benchmark_plot_pool(args, n_files)
+    elif name == 'logs':
+        n_lines = 20000
+        if len(args) > 0:
+            n_lines = int(args[0])
+        benchmark_log_parser(n_lines)
+
+
+if __name__ == '__main__':
+    main()
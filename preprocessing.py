@@ -1,3 +1,5 @@
+import threading
+
 import numpy as np
 from scipy.signal import find_peaks
 
@@ -81,29 +83,19 @@ class ReCIVA_log_preprocessor:
         # A flow: discover by the transition from zero flow to positive flow, then positive to zero
         #   must find flow boundaries
         #   interval starts at first positive after zero, end at first zero
-        flow_exists_array = flow_array > 0.01
-        flow_not_exists_array = np.logical_not(flow_exists_array)
-        flows = []
-        index = 0
-        while index < len(flow_array):
-            starts = np.argwhere(flow_exists_array[index:])
-            if len(starts) > 0:
-                start = starts[0][0] + index
-                ends = np.argwhere(flow_not_exists_array[start:])
-                if len(ends) > 0:
-                    end = ends[0][0] + start
-                    flows.append((start, end))
-                    index = end
-                else:
-                    break
-            else:
-                break
-        return np.array([time_array[flow[1]] - time_array[flow[0]] for flow in flows])
+        edges = np.diff((flow_array > 0.01).astype(np.int8), prepend=0)
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        # A flow still running when the session ends has no end and is not counted
+        return time_array[ends] - time_array[starts[:len(ends)]]
 
     def extract_cycles(self, name, t, y):
+        # Columns of a DataFrame or the online preprocessor's arrays alike
+        t = np.asarray(t)
+        y = np.asarray(y)
         first_index = np.argmax(y > 0)
-        t = t[first_index:].to_numpy()
-        y = y[first_index:].to_numpy()
+        t = t[first_index:]
+        y = y[first_index:]
 
 
         peak_indices, _ = find_peaks(y, height=np.mean(y), width=7)
@@ -114,4 +106,169 @@ class ReCIVA_log_preprocessor:
         if len(periods) > 0:
             out = {**out, **self.extract_summary(f'{name} cycle period', periods)}
 
-        return out
\ No newline at end of file
+        return out
+
+class RunningSummary(object):
+    # Mean, min, max and standard deviation merged batch by batch (Chan et al.), matching extract_summary on the
+    # concatenated values. ddof=1 follows a pandas column, ddof=0 a numpy array, which cannot summarise nothing.
+    def __init__(self, ddof=1):
+        self.ddof = ddof
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.nan
+        self.max = np.nan
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return
+        mean = values.mean()
+        m2 = np.square(values - mean).sum()
+        count = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / count
+        self.m2 += m2 + delta * delta * self.count * n / count
+        self.count = count
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+
+    def summary(self, name):
+        if self.count == 0 and self.ddof == 0:
+            raise ValueError(f'No values to summarise for {name}')
+        std = np.nan
+        if self.count > self.ddof:
+            std = np.sqrt(self.m2 / (self.count - self.ddof))
+        mean = self.mean if self.count > 0 else np.nan
+        return {f'{name} mean': mean, f'{name} min': self.min, f'{name} max': self.max, f'{name} s.dev': std}
+
+
+class RunningFlowIntervals(object):
+    # extract_flow_intervals carried across batches: a flow still running at the end of a batch keeps its start
+    def __init__(self):
+        self.flowing = False
+        self.start_time = None
+        self.summary = RunningSummary(ddof=0)
+
+    def update(self, flow_array, time_array):
+        flowing = flow_array > 0.01
+        edges = np.diff(flowing.astype(np.int8), prepend=np.int8(self.flowing))
+        start_times = time_array[edges == 1]
+        end_times = time_array[edges == -1]
+        if self.flowing:
+            start_times = np.concatenate(([self.start_time], start_times))
+        self.summary.update(end_times - start_times[:len(end_times)])
+        if len(start_times) > len(end_times):
+            self.start_time = start_times[-1]
+        if len(flowing) > 0:
+            self.flowing = bool(flowing[-1])
+
+
+class ReCIVA_online_preprocessor(ReCIVA_log_preprocessor):
+    columns = [
+        'Collection time', 'Flow rate L upstream', 'Flow rate L downstream', 'Pressure L upstream',
+        'Pressure L downstream', 'CO2stream', 'Mask pressure', 'Pump L current', 'Accumulated volume L', 'Voltage L',
+        'Pump L training current', 'Pump L live voltage'
+    ]
+    summaries = [
+        ('Pump current', 'Pump L current'), ('Mask pressure', 'Mask pressure'),
+        ('Pressure upstream', 'Pressure L upstream'), ('Pressure downstream', 'Pressure L downstream'),
+        ('Voltage', 'Voltage L'), ('Training current', 'Pump L training current'),
+        ('Live voltage', 'Pump L live voltage')
+    ]
+
+    # Same features as extract_features, kept up to date from the rows of each new batch so a score is available at
+    # any point of the collection. The acquisition thread updates it while the GUI reads it, hence the lock.
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.count = 0
+        self.first_time = np.nan
+        self.last_time = None
+        self.collection_time = None
+        self.intervals = RunningSummary(ddof=0)
+        self.column_summaries = {column: RunningSummary() for column in self.columns}
+        self.flow_intervals = {'upstream': RunningFlowIntervals(), 'downstream': RunningFlowIntervals()}
+        self.flow_summaries = {name: RunningSummary() for name in ['upstream', 'downstream', 'difference']}
+        self.flow_sums = {name: 0.0 for name in ['upstream', 'downstream', 'difference']}
+        # Peaks are found against the mean of the whole stream, so the CO2 samples are kept and searched on demand
+        self.co2_batches = []
+
+    def __len__(self):
+        return self.count
+
+    def update(self, data):
+        if len(data) == 0:
+            return
+        with self.lock:
+            t = data['Collection time']
+            if self.count == 0:
+                self.first_time = t[0]
+                self.intervals.update(self.diff(t))
+            else:
+                self.intervals.update(self.diff(np.concatenate(([self.last_time], t))))
+            self.last_time = t[-1]
+            self.count += len(data)
+
+            if self.collection_time is None:
+                collecting = np.flatnonzero(data['Accumulated volume L'] > 0.01)
+                if len(collecting) > 0:
+                    self.collection_time = t[collecting[0]]
+
+            for column, summary in self.column_summaries.items():
+                summary.update(data[column])
+            self.co2_batches.append(np.stack((t, data['CO2stream'])))
+
+            flows = {'upstream': data['Flow rate L upstream'], 'downstream': data['Flow rate L downstream']}
+            for name, flow in flows.items():
+                self.flow_intervals[name].update(flow, t)
+            flows['difference'] = flows['upstream'] - flows['downstream']
+            for name, flow in flows.items():
+                self.flow_summaries[name].update(flow if name == 'difference' else flow[flow > 0])
+                self.flow_sums[name] += flow.sum(dtype=np.float64)
+
+    def co2_stream(self):
+        if len(self.co2_batches) > 1:
+            self.co2_batches = [np.concatenate(self.co2_batches, axis=1)]
+        return self.co2_batches[0]
+
+    def current_features(self, extra=False):
+        n_before_cycles = 0
+        with self.lock:
+            features = {}
+            if extra:
+                features['Total time'] = self.column_summaries['Collection time'].max
+                features = {**features, **self.intervals.summary('Interval')}
+
+                collection_time = self.collection_time
+                if collection_time is None:
+                    collection_time = self.first_time
+                features['Time before collection'] = collection_time
+
+                features = {**features, **self.column_summaries['CO2stream'].summary('CO2stream')}
+                # Searched for peaks once the lock is released, so the acquisition thread is not held up: batches are
+                # only ever concatenated into new arrays, never changed in place
+                t, co2 = self.co2_stream()
+                n_before_cycles = len(features)
+
+                features = {**features, 'Accumulated volume L': self.column_summaries['Accumulated volume L'].max}
+                for name in ['upstream', 'downstream']:
+                    intervals = self.flow_intervals[name].summary
+                    features[f'Flow {name} length count'] = intervals.count
+                    features = {**features, **intervals.summary(f'Flow {name} length')}
+
+                for name, column in self.summaries:
+                    features = {**features, **self.column_summaries[column].summary(name)}
+
+            flow_names = [('Flow rate upstream', 'upstream'), ('Flow rate downstream', 'downstream'),
+                          ('Upstream-downstream flow rate difference', 'difference')]
+            for name, flow in flow_names:
+                features = {**features, **self.flow_summaries[flow].summary(name), f'{name} sum': self.flow_sums[flow]}
+
+        if extra:
+            # In the same place among the features as extract_features puts them
+            items = list(features.items())
+            features = {**dict(items[:n_before_cycles]), **self.extract_cycles('CO2stream', t, co2),
+                        **dict(items[n_before_cycles:])}
+        return features